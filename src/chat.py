@@ -1,16 +1,82 @@
+import asyncio
+import functools
+import hashlib
+import logging
+import threading
 import uuid
-from typing import List, Dict, Any
+from collections import deque, OrderedDict
+from typing import List, Dict, Any, Optional, AsyncIterator
 
+import httpx
 from openai import AsyncOpenAI
 from openai.types.chat import ChatCompletionAssistantMessageParam as AssistantMessage
-from openai.types.chat import ChatCompletionContentPartImageParam as ContentPartImage
 from openai.types.chat import ChatCompletionMessageParam as Message
 from openai.types.chat import ChatCompletionSystemMessageParam as SystemMessage
 from openai.types.chat import ChatCompletionUserMessageParam as UserMessage
-from openai.types.chat.chat_completion_content_part_image_param import ImageURL
 
+from src.serialization import json_dumps_bytes, json_loads
 from src.store import get_opensearch_store
 
+logger = logging.getLogger(__name__)
+
+# Content of a screenshot message that fell out of the `max_images` window
+SCREENSHOT_PLACEHOLDER = "[screenshot omitted]"
+
+# Content part types that carry a screenshot; `image_ref` points into the session's image store
+_IMAGE_PART_TYPES = ("image_url", "image_ref")
+
+# Roles restored from persisted context as plain `{"role", "content"}` messages
+_MESSAGE_ROLES = ("system", "user", "assistant")
+
+# Prefix of the user message carrying the session memories
+_MEM_PREFIX = "Memories:\n"
+
+# LRU cache of model replies keyed by session, screenshot and previous reply
+_RESPONSE_CACHE: "OrderedDict[str, str]" = OrderedDict()
+_RESPONSE_CACHE_SIZE = 256
+
+# Connection pool shared by every AsyncOpenAI client, whatever its API key
+_HTTP_CLIENT: Optional[httpx.AsyncClient] = None
+_http_client_lock = threading.Lock()
+
+
+@functools.lru_cache(maxsize=32)
+def _system_message(content: str) -> SystemMessage:
+    # Sessions with the same system prompt share one message object; it is never mutated
+    return SystemMessage(role="system", content=content)
+
+
+def _shared_http_client() -> httpx.AsyncClient:
+    global _HTTP_CLIENT
+    if _HTTP_CLIENT is None:
+        with _http_client_lock:
+            if _HTTP_CLIENT is None:
+                _HTTP_CLIENT = httpx.AsyncClient(
+                    limits=httpx.Limits(max_connections=100, max_keepalive_connections=100),
+                    timeout=60
+                )
+    return _HTTP_CLIENT
+
+
+def get_async_openai(api_key: Optional[str], base_url: Optional[str]) -> AsyncOpenAI:
+    """
+    Get an AsyncOpenAI client for the given credentials.
+
+    Only the underlying httpx client is shared, so sessions reuse its keep-alive connection
+    pool instead of paying TCP+TLS setup on every task. The AsyncOpenAI wrapper is cheap and
+    built per call, so caller-supplied API keys are not retained.
+    """
+    return AsyncOpenAI(api_key=api_key, base_url=base_url, http_client=_shared_http_client())
+
+
+async def close_async_openai_clients():
+    """Close the connection pool shared by AsyncOpenAI clients."""
+    global _HTTP_CLIENT
+    with _http_client_lock:
+        http_client, _HTTP_CLIENT = _HTTP_CLIENT, None
+    if http_client is not None:
+        await http_client.aclose()
+
 
 class AsyncChatModelClient(object):
     """
@@ -19,92 +85,330 @@ class AsyncChatModelClient(object):
     Handles message history, image content processing and API communication with large language models.
     """
 
-    def __init__(self, ai_client: AsyncOpenAI, model_name: str, thinking_type: str = "", session_id: str = None):
+    def __init__(self, ai_client: Optional[AsyncOpenAI], model_name: str, thinking_type: str = "",
+                 session_id: str = None, api_key: Optional[str] = None, base_url: Optional[str] = None):
         self.messages: List[Message] = []
         self.output_messages: List[Message] = []
         self.prompt_count: int = 0
         self.memories: List[str] = []
-        self.ai_client = ai_client
+        self.ai_client = ai_client or get_async_openai(api_key, base_url)
         self.model_name = model_name
         self.max_images = 5
         self.max_messages = 20
+        # Hard ceiling on the number of messages after the prompt
+        self.max_history = 2 * (self.max_images + self.max_messages)
+        # Compact the history once more than this fraction of it is stale
+        self._invalidate_cache_threshold = 0.5
+        # Incrementally maintained view of the history after the prompt
+        self._image_indices: deque[int] = deque()
+        self._masked_count: int = 0
+        self._tail_msg_count: int = 0
+        # Screenshot URLs by content hash, referenced from `image_ref` content parts
+        self._image_blob: Dict[str, str] = {}
+        # Whether the provider honours the `n` parameter for multiple completions
+        self.supports_n = False
+        # Reuse the reply to a repeated (screenshot, previous reply) pair. Off by default: a hit
+        # means the last action left the screen unchanged, and replaying a reply can repeat it
+        self.cache_responses = False
         self.model_kwargs = {}
         self.model_kwargs['thinking'] = {'type': thinking_type}
         self.session_id = session_id or str(uuid.uuid4())
 
-    def setup_prompt(self, system_prompt: str, user_system_prompt: str, user_prompt: str):
-        self.messages.append(SystemMessage(role="system", content=system_prompt))
+    async def setup_prompt(self, system_prompt: str, user_system_prompt: str, user_prompt: str):
+        """
+        Build the initial prompt messages.
+
+        Messages are ordered from most to least stable: the static system prompt, the
+        caller's system prompt as its own system message, memories, then the instruction.
+        Nothing per-session (ids, timestamps) is written into the system block, so the
+        provider's automatic prefix cache can be reused across sessions. The memory search
+        is blocking, so it runs in a worker thread.
+        """
+        self.messages.append(_system_message(system_prompt))
+        # Normalize whitespace so equivalent prompts produce byte-identical prefixes
+        user_system_prompt = user_system_prompt.strip() if user_system_prompt else ""
         if user_system_prompt:
             self.messages.append(SystemMessage(role="system", content=user_system_prompt))
         memories = []
         store = get_opensearch_store()
         if store:
             # Use session-specific namespace for memory isolation
-            memories = store.search((self.session_id,), query=user_prompt, limit=3)
+            memories = await asyncio.to_thread(store.search, (self.session_id,), query=user_prompt, limit=3)
         if memories:
-            print("memories=%s", memories)
+            logger.debug("memories=%s", memories)
             self.memories = [memory.value['text'] for memory in memories]
-            memories_msg = "\n".join(self.memories)
-            self.messages.append(SystemMessage(role="system", content=f"Memories:\n{memories_msg}"))
-            # self.messages.append(UserMessage(role="user", content=f"Memories:\n{memories_msg}"))
+            self.messages.append(UserMessage(role="user", content=_MEM_PREFIX + "\n".join(self.memories)))
 
         self.messages.append(UserMessage(role="user", content=user_prompt))
         self.prompt_count = len(self.messages)
+        self._rebuild_history_index()
 
-    async def process_screenshot_and_update_history_messages(self, screenshot_image_url: str) -> str:
-        snap_content = ContentPartImage(type="image_url", image_url=ImageURL(url=screenshot_image_url))
-        screenshot_message = UserMessage(role="user", content=[snap_content])
-        self.messages.append(screenshot_message)
+    def add_user_message(self, content: str):
+        """
+        Append a user text message to the history.
+        """
+        self._append_text_message(UserMessage(role="user", content=content))
+
+    def _append_text_message(self, msg: Message):
+        """
+        Append a text message, compacting the history if it exceeds `max_history` messages
+        after the prompt. Screenshot turns are bounded by `_remove_overflow_image_messages`,
+        this keeps text-only growth bounded as well.
+        """
+        self.messages.append(msg)
+        self._tail_msg_count += 1
+        if len(self.messages) - self.prompt_count > self.max_history:
+            self._compact_messages()
+
+    def _append_screenshot(self, screenshot_image_url: str):
+        # Keep only a content-addressed reference in the history; identical screenshots share one entry
+        img_id = hashlib.sha256(screenshot_image_url.encode()).hexdigest()
+        self._image_blob[img_id] = screenshot_image_url
+        self.messages.append({"role": "user", "content": [{"type": "image_ref", "id": img_id}]})
+        self._image_indices.append(len(self.messages) - 1)
         self._remove_overflow_image_messages()
-        completion = await self.ai_client.chat.completions.create(messages=self.messages,
-                                                                  model=self.model_name,
-                                                                  extra_body=self.model_kwargs
-                                                                  )
-        print("completion=%s", completion)
-        content = completion.choices[0].message.content
-        self.messages.append(AssistantMessage(role="assistant", content=content))
+
+    def _materialize_messages(self) -> List[Message]:
+        """
+        Build the message list for an API request, resolving image references to `image_url` parts.
+        """
+        messages = list(self.messages)
+        image_blob = self._image_blob
+        for idx in self._image_indices:
+            msg = messages[idx]
+            messages[idx] = {**msg, "content": [
+                {"type": "image_url", "image_url": {"url": image_blob[item["id"]]}}
+                if isinstance(item, dict) and item.get("type") == "image_ref" else item
+                for item in msg["content"]
+            ]}
+        return messages
+
+    def _last_reply(self) -> str:
+        for msg in reversed(self.messages):
+            if msg.get("role") == "assistant":
+                return msg.get("content") or ""
+        return ""
+
+    def _response_cache_key(self, screenshot_image_url: str, last_reply: str) -> str:
+        key = f"{self.session_id}|{screenshot_image_url}|{last_reply}"
+        return hashlib.blake2b(key.encode(), digest_size=16).hexdigest()
+
+    async def process_screenshot_and_update_history_messages(self, screenshot_image_url: str) -> str:
+        content = cache_key = None
+        if self.cache_responses:
+            # The same screenshot after the same previous reply gets the same answer, unless
+            # that answer is the previous reply itself, which would replay the stalled action
+            last_reply = self._last_reply()
+            cache_key = self._response_cache_key(screenshot_image_url, last_reply)
+            content = _RESPONSE_CACHE.get(cache_key)
+            if content is not None and content == last_reply:
+                content = None
+        self._append_screenshot(screenshot_image_url)
+        if content is not None:
+            _RESPONSE_CACHE.move_to_end(cache_key)
+        else:
+            messages = self._materialize_messages()
+            completion = await self.ai_client.chat.completions.create(messages=messages,
+                                                                      model=self.model_name,
+                                                                      extra_body=self.model_kwargs
+                                                                      )
+            logger.debug("completion=%s", completion)
+            content = completion.choices[0].message.content
+            if cache_key is not None:
+                _RESPONSE_CACHE[cache_key] = content
+                if len(_RESPONSE_CACHE) > _RESPONSE_CACHE_SIZE:
+                    _RESPONSE_CACHE.popitem(last=False)
+        self._append_text_message(AssistantMessage(role="assistant", content=content))
         return content.replace("```", "")
 
+    async def sample_k(self, screenshot_image_url: str, k: int) -> List[str]:
+        """
+        Sample `k` candidate replies for the current screenshot.
+
+        When `supports_n` is set, the candidates share one prefill pass through the `n`
+        parameter; otherwise `k` requests are sent concurrently. The candidates are not
+        added to the history, call `commit_candidate` with the chosen one.
+
+        Args:
+            screenshot_image_url: URL of the current screenshot
+            k: Number of candidates
+
+        Returns:
+            List of candidate replies
+        """
+        self._append_screenshot(screenshot_image_url)
+        messages = self._materialize_messages()
+        if self.supports_n:
+            completion = await self.ai_client.chat.completions.create(messages=messages,
+                                                                      model=self.model_name,
+                                                                      extra_body=self.model_kwargs,
+                                                                      n=k
+                                                                      )
+            choices = completion.choices
+        else:
+            completions = await asyncio.gather(*(
+                self.ai_client.chat.completions.create(messages=messages,
+                                                       model=self.model_name,
+                                                       extra_body=self.model_kwargs
+                                                       )
+                for _ in range(k)
+            ))
+            choices = [completion.choices[0] for completion in completions]
+        return [choice.message.content.replace("```", "") for choice in choices]
+
+    def commit_candidate(self, content: str):
+        """
+        Append the candidate chosen from `sample_k` to the history.
+        """
+        self._append_text_message(AssistantMessage(role="assistant", content=content))
+
+    async def process_screenshot_and_stream(self, screenshot_image_url: str) -> AsyncIterator[str]:
+        """
+        Streaming variant of `process_screenshot_and_update_history_messages`.
+
+        Yields content deltas as they arrive so callers can start parsing before the
+        completion ends. The full reply is appended to the history once the stream is done.
+
+        Args:
+            screenshot_image_url: URL of the current screenshot
+
+        Yields:
+            Raw content deltas from the model
+        """
+        self._append_screenshot(screenshot_image_url)
+        messages = self._materialize_messages()
+        stream = await self.ai_client.chat.completions.create(messages=messages,
+                                                              model=self.model_name,
+                                                              extra_body=self.model_kwargs,
+                                                              stream=True
+                                                              )
+        parts: List[str] = []
+        async for chunk in stream:
+            if not chunk.choices:
+                continue
+            delta = chunk.choices[0].delta.content
+            if delta:
+                parts.append(delta)
+                yield delta
+        self._append_text_message(AssistantMessage(role="assistant", content="".join(parts)))
+
+    @classmethod
+    async def process_batch(cls, clients: List['AsyncChatModelClient'], urls: List[str],
+                            max_concurrent: int = 32) -> List[str]:
+        """
+        Run one screenshot turn for several sessions concurrently.
+
+        Args:
+            clients: Chat sessions, one per screenshot
+            urls: Screenshot URLs matching `clients` by position
+            max_concurrent: Maximum number of in-flight completion requests
+
+        Returns:
+            List of model responses in the same order as `clients`
+        """
+        if len(clients) != len(urls):
+            raise ValueError("clients and urls must have the same length")
+        semaphore = asyncio.Semaphore(max_concurrent)
+
+        async def _process(client: 'AsyncChatModelClient', url: str) -> str:
+            async with semaphore:
+                return await client.process_screenshot_and_update_history_messages(url)
+
+        return list(await asyncio.gather(*(_process(c, u) for c, u in zip(clients, urls))))
+
     def _remove_overflow_image_messages(self):
+        """
+        Mask screenshots beyond `max_images` in place instead of dropping them.
+
+        The history stays append-only so the prompt prefix is stable between turns and
+        the provider's KV cache keeps hitting. Once more than `_invalidate_cache_threshold`
+        of the history is stale, it is compacted once with `_compact_messages`.
+        """
+        messages = self.messages
+        image_indices = self._image_indices
+        while len(image_indices) > self.max_images:
+            idx = image_indices.popleft()
+            self._release_image_refs(messages[idx])
+            messages[idx] = UserMessage(role="user", content=SCREENSHOT_PLACEHOLDER)
+            self._masked_count += 1
+
+        tail_size = len(messages) - self.prompt_count
+        stale_count = self._masked_count + max(self._tail_msg_count - self.max_messages, 0)
+        if tail_size and stale_count / tail_size > self._invalidate_cache_threshold:
+            self._compact_messages()
+
+    def _release_image_refs(self, msg: Message):
+        """
+        Drop stored screenshot URLs that are no longer referenced by a visible screenshot.
+        """
+        live_ids = {item["id"] for i in self._image_indices for item in self.messages[i]["content"]
+                    if isinstance(item, dict) and item.get("type") == "image_ref"}
+        for item in msg["content"]:
+            if isinstance(item, dict) and item.get("type") == "image_ref" and item["id"] not in live_ids:
+                self._image_blob.pop(item["id"], None)
+
+    def _rebuild_history_index(self):
+        """
+        Rescan the history after the prompt to rebuild the screenshot indices and counters.
+        """
+        image_indices = self._image_indices
+        image_indices.clear()
+        masked_count = 0
+        msg_count = 0
+        messages = self.messages
+        for idx in range(self.prompt_count, len(messages)):
+            cs = messages[idx].get("content")
+            if isinstance(cs, list) and any(
+                    isinstance(item, dict) and item.get("type") in _IMAGE_PART_TYPES for item in cs):
+                image_indices.append(idx)
+            elif cs == SCREENSHOT_PLACEHOLDER:
+                masked_count += 1
+            else:
+                msg_count += 1
+        self._masked_count = masked_count
+        self._tail_msg_count = msg_count
+
+    def _compact_messages(self):
+        """
+        Rebuild the history once, keeping the prompt, the output messages, the latest
+        `max_images` screenshots and the latest `max_messages` text messages.
+        """
         max_images = self.max_images
         max_messages = self.max_messages
 
-        keep_indices = set()
+        kept_rev = []
+        keep = kept_rev.append
         img_count = 0
         msg_count = 0
 
         preserved_messages = self.messages[:self.prompt_count]
         other_messages = self.messages[self.prompt_count:]
+        output_ids = {id(msg) for msg in self.output_messages}
 
-        for idx in reversed(range(len(other_messages))):
-            msg = other_messages[idx]
+        for msg in reversed(other_messages):
             cs = msg.get("content")
-
-            image_contents = []
-            non_image_contents = []
+            if id(msg) in output_ids:
+                keep(msg)
+                continue
+            if cs == SCREENSHOT_PLACEHOLDER:
+                continue
 
             if isinstance(cs, list):
-                for item in cs:
-                    if isinstance(item, dict) and item.get("type") == "image_url":
-                        image_contents.append(item)
-                    else:
-                        non_image_contents.append(item)
-            if image_contents and img_count < max_images:
+                n_img = sum(1 for item in cs if isinstance(item, dict) and item.get("type") in _IMAGE_PART_TYPES)
+                n_other = len(cs) - n_img
+            else:
+                n_img, n_other = 0, 1
+            if n_img and img_count < max_images:
                 # 注意，如果存在多张，会超出，当前仅有一张, 无需过滤适配
-                img_count += len(image_contents)
-                keep_indices.add(idx)
-            elif not image_contents and msg_count < max_messages:
-                if non_image_contents:
-                    msg_count += len(non_image_contents)
-                else:
-                    msg_count += 1
-                keep_indices.add(idx)
-
-            if img_count >= max_images and msg_count >= max_messages:
-                break
+                img_count += n_img
+                keep(msg)
+            elif not n_img and msg_count < max_messages:
+                msg_count += n_other or 1
+                keep(msg)
 
-        messages = [msg for i, msg in enumerate(other_messages) if i in keep_indices]
-        self.messages = preserved_messages + self.output_messages + messages
+        kept_rev.reverse()
+        self.messages = preserved_messages + kept_rev
+        self._rebuild_history_index()
 
     def add_output_messages(self):
         """
@@ -120,27 +424,41 @@ class AsyncChatModelClient(object):
             List of message dictionaries without image URLs
         """
         context = []
+        append = context.append
         for msg in self.messages:
-            msg_dict = dict(msg)
-            content = msg_dict.get("content")
+            content = msg.get("content")
+            if not isinstance(content, list):
+                if content != SCREENSHOT_PLACEHOLDER:  # Masked screenshots carry no context
+                    # Messages are never mutated in place, so they can be shared
+                    append(msg)
+                continue
 
             # Remove image content from messages
-            if isinstance(content, list):
-                filtered_content = []
-                for item in content:
-                    if isinstance(item, dict) and item.get("type") != "image_url":
-                        filtered_content.append(item)
-                    elif not isinstance(item, dict):
-                        filtered_content.append(item)
+            filtered_content = [item for item in content
+                                if not (isinstance(item, dict) and item.get("type") in _IMAGE_PART_TYPES)]
+            if not filtered_content:
+                continue  # Skip messages with only images
+            append({**msg, "content": filtered_content[0] if len(filtered_content) == 1 else filtered_content})
 
-                if filtered_content:
-                    msg_dict["content"] = filtered_content[0] if len(filtered_content) == 1 else filtered_content
-                else:
-                    continue  # Skip messages with only images
+        return context
 
-            context.append(msg_dict)
+    def dump_context_bytes(self) -> bytes:
+        """
+        Serialize the persistence context to JSON bytes.
 
-        return context
+        Returns:
+            JSON encoded list of message dictionaries without image URLs
+        """
+        return json_dumps_bytes(self.get_context_for_persistence())
+
+    def load_context_bytes(self, data: bytes):
+        """
+        Restore LLM conversation context from JSON bytes produced by `dump_context_bytes`.
+
+        Args:
+            data: JSON encoded list of message dictionaries
+        """
+        self.restore_context_from_persistence(json_loads(data))
 
     def restore_context_from_persistence(self, context: List[Dict[str, Any]]):
         """
@@ -150,21 +468,27 @@ class AsyncChatModelClient(object):
             context: List of message dictionaries to restore
         """
         self.messages = []
+        self._image_blob.clear()
+        append = self.messages.append
         for msg in context:
-            role = msg.get("role")
-            content = msg.get("content")
+            get = msg.get
+            role = get("role")
 
             # Reconstruct the appropriate message type based on role
-            if role == "system":
-                self.messages.append(SystemMessage(role="system", content=content))
-            elif role == "user":
-                self.messages.append(UserMessage(role="user", content=content))
-            elif role == "assistant":
-                self.messages.append(AssistantMessage(role="assistant", content=content))
+            if role in _MESSAGE_ROLES:
+                append({"role": role, "content": get("content")})
             else:
-                # Fallback: treat as dict
-                self.messages.append(msg)
+                # Fallback: normalize to a plain dict
+                append(dict(msg))
 
-        # Recalculate prompt_count
-        self.prompt_count = len([m for m in self.messages if m.get("role") == "system" or
-                                 (m.get("role") == "user" and self.messages.index(m) < 3)])
+        # Recalculate prompt_count: the prompt is the leading run of system messages
+        # followed by the user messages (memories, instruction) before the first reply
+        count = 0
+        for i, m in enumerate(self.messages):
+            role = m.get("role")
+            if role == "system" or role == "user":
+                count = i + 1
+            else:
+                break
+        self.prompt_count = count
+        self._rebuild_history_index()
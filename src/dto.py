@@ -3,21 +3,32 @@ from typing import Optional
 
 from lybic import LybicAuth
 from lybic.dto import CreateSandboxDto
-from pydantic import BaseModel
+from pydantic import BaseModel, ConfigDict
+
+# Resolved once at import time; `.env` is loaded before this module is imported
+_DEFAULT_ENDPOINT = os.getenv("LYBIC_API_ENDPOINT", "https://api.lybic.cn")
+
+# Request DTOs are read-only once decoded
+_REQUEST_MODEL_CONFIG = ConfigDict(frozen=True, extra='ignore')
 
 class LybicAuthentication(BaseModel):
+    model_config = _REQUEST_MODEL_CONFIG
+
     api_key: str
     org_id: str
     api_endpoint: Optional[str] = None
 
 def req_auth_from_dto(auth: Optional[LybicAuthentication]) -> LybicAuth:
     if auth:
-        if auth.api_endpoint is None:
-            endpoint = os.getenv("LYBIC_API_ENDPOINT", "https://api.lybic.cn")
-        else:
-            endpoint = auth.api_endpoint
-        return LybicAuth(auth.org_id, auth.api_key, endpoint)
+        return LybicAuth(auth.org_id, auth.api_key, auth.api_endpoint or _DEFAULT_ENDPOINT)
     return LybicAuth()
+
+# Secrets are never persisted with the task
+_REQUEST_DATA_EXCLUDE = frozenset({'authentication', 'ark_apikey'})
+
+def req_data_from_dto(req: BaseModel) -> dict:
+    """Dump a request once for storage in `TaskData.request_data`, without credentials"""
+    return req.model_dump(exclude=_REQUEST_DATA_EXCLUDE, exclude_none=True)
 # class CreateSandboxDto(BaseModel):
 #     """
 #     Create sandbox request.
@@ -29,14 +40,20 @@ def req_auth_from_dto(auth: Optional[LybicAuthentication]) -> LybicAuth:
 #     projectId: Optional[str] = Field(None, description="The project id to use for the sandbox. Use default if not provided.")
 #     shape: str = Field(..., description="Specs and datacenter of the sandbox.") # 'beijing-2c-4g-cpu'
 class CreateSandboxRequest(CreateSandboxDto):
+    model_config = _REQUEST_MODEL_CONFIG
+
     authentication: Optional[LybicAuthentication] = None
 
 class CancelRequest(BaseModel):
+    model_config = _REQUEST_MODEL_CONFIG
+
     task_id: Optional[str] = None
     authentication: Optional[LybicAuthentication] = None
 
 
 class SubmitTaskRequest(BaseModel):
+    model_config = _REQUEST_MODEL_CONFIG
+
     instruction: str
     user_system_prompt: Optional[str] = None
     sandbox_id: Optional[str] = None
@@ -48,6 +65,8 @@ class SubmitTaskRequest(BaseModel):
 
 
 class RunAgentRequest(BaseModel):
+    model_config = _REQUEST_MODEL_CONFIG
+
     instruction: str
     user_system_prompt: Optional[str] = None
     sandbox_id: Optional[str] = None
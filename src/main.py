@@ -12,40 +12,66 @@ else:
         load_dotenv(dotenv_path=parent_env_path)
 
 import asyncio
-import json
+import os
 import uuid
 import logging
-import re
+from contextlib import aclosing, asynccontextmanager
+from datetime import datetime, timezone
+from typing import Optional
 
 # Setup logging
 logger = logging.getLogger(__name__)
 
 from fastapi import FastAPI, HTTPException
-from fastapi.responses import StreamingResponse, JSONResponse
+from fastapi.responses import StreamingResponse, JSONResponse, Response
 from lybic import Sandbox, LybicClient
-from lybic.dto import GetSandboxResponseDto
-from openai import AsyncOpenAI
-from openai.types.chat import ChatCompletionUserMessageParam as UserMessage
+from lybic.dto import CreateSandboxDto, GetSandboxResponseDto
 from httpx import HTTPStatusError
 
-from src.dto import *
-from src.chat import AsyncChatModelClient
-from src.planner import Planner
+from src.dto import (
+    CancelRequest, CreateSandboxRequest, RunAgentRequest, SubmitTaskRequest,
+    req_auth_from_dto, req_data_from_dto
+)
+from src.chat import AsyncChatModelClient, close_async_openai_clients, get_async_openai
+from src.planner import Planner, buffered, format_sse, is_final_event
 from src.storage import create_storage, TaskData
 from src.prompts import DOUBAO_UI_TARS_SYSTEM_PROMPT_ZH
+from src.serialization import json_dumps_bytes
 
-logging.basicConfig(level=os.environ.get("LOG_LEVEL", "DEBUG"))
+_LOG_LEVEL = os.environ.get("LOG_LEVEL", "DEBUG")
+logging.basicConfig(level=_LOG_LEVEL)
 app = FastAPI(
     title='Lybic Single Model Agent Server',
 )
 
-# Global dictionary to track active tasks with thread-safe lock
+# Global dictionary to track active tasks; single dict operations are atomic on
+# the event loop, so no lock is needed
 active_tasks = {}
-active_tasks_lock = asyncio.Lock()
+
+# Strong references to fire-and-forget tasks; the event loop only keeps weak ones
+_background_tasks = set()
 
 # Initialize storage for task persistence
 task_storage = create_storage()
 
+def _dispatch_cancel_notification(task_id: str):
+    """Flag a locally running task as cancelled when a cancel NOTIFY arrives"""
+    planner = active_tasks.get(task_id)
+    if planner:
+        planner.cancelled = True
+        logger.info(f"Task {task_id} cancelled via NOTIFY")
+
+# One dispatcher serves every task, so no per-task listener is registered
+if hasattr(task_storage, 'set_cancel_dispatcher'):
+    task_storage.set_cancel_dispatcher(_dispatch_cancel_notification)
+
+ARK_API_ENDPOINT = os.environ.get('ARK_API_ENDPOINT', 'https://ark.cn-beijing.volces.com/api/v3')
+
+@app.on_event('shutdown')
+async def shutdown():
+    """Release shared LLM client connections"""
+    await close_async_openai_clients()
+
 @app.get('/api/health')
 async def health():
     """Health check endpoint"""
@@ -85,12 +111,10 @@ async def create_sandbox(req: CreateSandboxRequest):
             'message': f'Sandbox {sandbox_id} created successfully'
         })
     except HTTPStatusError as he:
-        import traceback
-        traceback.print_exc()
+        logger.exception("Failed to create sandbox")
         raise HTTPException(status_code=he.response.status_code, detail=str(he))
     except Exception as e:
-        import traceback
-        traceback.print_exc()
+        logger.exception("Failed to create sandbox")
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.post('/api/agent/run')
@@ -100,6 +124,8 @@ async def run_agent(req: RunAgentRequest):
         if not req.instruction:
             raise HTTPException(status_code=400, detail='instruction is required')
 
+        request_data = req_data_from_dto(req)
+
         async def generate():
             sandbox_id = req.sandbox_id
             if sandbox_id is None:
@@ -132,77 +158,44 @@ async def run_agent(req: RunAgentRequest):
                         query=req.instruction,
                         max_steps=50,
                         sandbox_info={'sandbox_id': sandbox_id},
-                        request_data=req.model_dump()
+                        request_data=request_data
                     )
                     await task_storage.create_task(new_task)
                 
-                # Setup model and planner using shared function
-                model_client, planner=  _setup_model_and_planner(
-                    task_id, sandbox_id, req.instruction, 
-                    req.continue_context, existing_context,req.user_system_prompt,
-                    LybicClient(req_auth_from_dto(req.authentication)),req.ark_apikey
-                )
-                
-                # Show context restored message if applicable
-                if existing_context:
-                    yield f"data: {json.dumps({'stage': 'System', 'message': '🔄 Context restored, continuing conversation...', 'taskId': task_id, 'timestamp': __import__('datetime').datetime.now().isoformat()}, ensure_ascii=False)}\n\n"
+                # Close the Lybic client once the planner is done with it
+                async with LybicClient(req_auth_from_dto(req.authentication)) as lybic_client:
+                    # Setup model and planner using shared function
+                    model_client, planner = await _setup_model_and_planner(
+                        task_id, sandbox_id, req.instruction, 
+                        req.continue_context, existing_context,req.user_system_prompt,
+                        lybic_client,req.ark_apikey
+                    )
                 
-                # Register NOTIFY listener if using PostgreSQL
-                if hasattr(task_storage, 'register_cancel_listener'):
-                    def cancel_callback(cancelled_task_id):
-                        if cancelled_task_id == task_id:
-                            planner.cancelled = True
-                            logger.info(f"Task {task_id} cancelled via NOTIFY")
-                    
-                    task_storage.register_cancel_listener(task_id, cancel_callback)
+                    # Show context restored message if applicable
+                    if existing_context:
+                        yield format_sse({'stage': 'System', 'message': '🔄 Context restored, continuing conversation...', 'taskId': task_id, 'timestamp': datetime.now(timezone.utc)})
                 
-                # Store planner in active tasks with thread-safe lock
-                async with active_tasks_lock:
-                    active_tasks[task_id] = planner
-
-                task_cancelled = False
-                final_msg:str|None = None
-                needs_human_intervention = False
-                try:
-                    messages =  _execute_planner_with_context_saving(
-                        planner, model_client, task_id, sandbox_id
-                    )
-
-                    # Yield all collected messages
-                    async for msg in messages:
-                        yield msg
-                        
-                        # Check for human intervention needed and extract message
-                        try:
-                            msg_data = json.loads(msg.replace('data: ', '').strip())
-                            if msg_data.get('needs_human'):
-                                needs_human_intervention = True
-                                final_msg = msg_data.get('message', '')
+                    # The planner runs ahead of the HTTP writes through a bounded buffer;
+                    # the task is finalized when the block exits
+                    async with _running_task(task_id, sandbox_id, planner, model_client) as on_event, \
+                            aclosing(buffered(planner.run_task(lang="zh"))) as events:
+                        # Serialize events to SSE only at the HTTP boundary
+                        async for event in events:
+                            yield format_sse(event)
+                            if is_final_event(event):
                                 break
-                            # Also extract finished message if present
-                            if msg_data.get('stage') == 'Planner':
-                                final_msg = msg_data.get('message', '')
-                        except:
-                            pass
-                except asyncio.CancelledError:
-                    task_cancelled = True
-                    logger.info(f"Task {task_id} was cancelled")
-                finally:
-                    # Unregister NOTIFY listener if using PostgreSQL
-                    if hasattr(task_storage, 'unregister_cancel_listener'):
-                        task_storage.unregister_cancel_listener(task_id)
-                    
-                    await _finalize_task(task_id, model_client, task_cancelled, planner,final_msg, needs_human_intervention=needs_human_intervention)
+                            on_event()
             except Exception as e:
                 logger.error(f"Error in generate(): {e}")
                 raise
         
         return StreamingResponse(
             generate(),
-            media_type='text/event-stream',
+            media_type='text/event-stream; charset=utf-8',
             headers={
                 'Cache-Control': 'no-cache',
-                'X-Accel-Buffering': 'no'
+                'X-Accel-Buffering': 'no',
+                'Connection': 'keep-alive'
             }
         )
     except HTTPException:
@@ -217,50 +210,38 @@ async def submit_async_task(req: SubmitTaskRequest):
         if not req.instruction:
             raise HTTPException(status_code=400, detail='Instruction is required')
         
+        request_data = req_data_from_dto(req)
+        
         # Determine task ID and check for context restoration
+        task_data = None
         if req.continue_context and req.task_id:
+            task_data = await task_storage.get_task(req.task_id)
+
+        if task_data:
             task_id = req.task_id
-            # Check if task exists and get context
-            task_data = await task_storage.get_task(task_id)
-            if task_data:
-                # Restore sandbox_id from previous task if not provided
-                sandbox_id = req.sandbox_id
-                if not sandbox_id and task_data.sandbox_info:
-                    sandbox_id = task_data.sandbox_info.get('sandbox_id')
-                # Update task status to running
-                await task_storage.update_task(task_id, {
-                    'status': 'running',
-                    'query': req.instruction
-                })
-            else:
-                # Task not found, create new one
-                task_id = str(uuid.uuid4())
-                task_data = TaskData(
-                    task_id=task_id,
-                    status='pending',
-                    query=req.instruction,
-                    max_steps=req.max_steps,
-                    sandbox_info={'sandbox_id': req.sandbox_id} if req.sandbox_id else None,
-                    request_data=req.model_dump()
-                )
-                await task_storage.create_task(task_data)
+            # Update task status to running
+            await task_storage.update_task(task_id, {
+                'status': 'running',
+                'query': req.instruction
+            })
         else:
-            # Generate new task ID
+            # New session, or the task to continue was not found
             task_id = str(uuid.uuid4())
-            task_data = TaskData(
+            await task_storage.create_task(TaskData(
                 task_id=task_id,
                 status='pending',
                 query=req.instruction,
                 max_steps=req.max_steps,
                 sandbox_info={'sandbox_id': req.sandbox_id} if req.sandbox_id else None,
-                request_data=req.model_dump()
-            )
-            await task_storage.create_task(task_data)
+                request_data=request_data
+            ))
         
         # Start task execution in background
-        asyncio.create_task(
+        background_task = asyncio.create_task(
             execute_task_background(task_id, req)
         )
+        _background_tasks.add(background_task)
+        background_task.add_done_callback(_background_tasks.discard)
         
         return JSONResponse({
             'success': True,
@@ -286,67 +267,23 @@ async def execute_task_background(task_id: str, req: SubmitTaskRequest):
         if req.continue_context and req.task_id:
             existing_context = await task_storage.get_llm_context(task_id)
         
-        # Setup model and planner using shared function
-        model_client, planner =  _setup_model_and_planner(
-            task_id, sandbox_id, req.instruction,
-            req.continue_context, existing_context,req.user_system_prompt,
-            LybicClient(req_auth_from_dto(req.authentication)),
-            req.ark_apikey
-        )
-        
-        # Register NOTIFY listener if using PostgreSQL
-        if hasattr(task_storage, 'register_cancel_listener'):
-            def cancel_callback(cancelled_task_id):
-                if cancelled_task_id == task_id:
-                    planner.cancelled = True
-                    logger.info(f"Task {task_id} cancelled via NOTIFY")
-            
-            task_storage.register_cancel_listener(task_id, cancel_callback)
-        
-        # Store planner in active tasks
-        async with active_tasks_lock:
-            active_tasks[task_id] = planner
-        
-        task_cancelled = False
-        final_output = None
-        error = None
-        needs_human_intervention = False
+        # Close the Lybic client once the planner is done with it
+        async with LybicClient(req_auth_from_dto(req.authentication)) as lybic_client:
+            # Setup model and planner using shared function
+            model_client, planner = await _setup_model_and_planner(
+                task_id, sandbox_id, req.instruction,
+                req.continue_context, existing_context,req.user_system_prompt,
+                lybic_client,
+                req.ark_apikey
+            )
         
-        try:
-            async for msg in _execute_planner_with_context_saving(
-                 planner, model_client, task_id, sandbox_id
-             ):
-                msg_or_none=_get_finished_message(msg)
-                if isinstance(msg_or_none,str):
-                    final_output=msg_or_none
-                
-                # Check for human intervention needed and extract message
-                try:
-                    msg_data = json.loads(msg.replace('data: ', '').strip())
-                    if msg_data.get('needs_human'):
-                        needs_human_intervention = True
-                        final_output = msg_data.get('message', '')
+            # Errors are recorded on the task rather than raised, nobody awaits this coroutine
+            async with _running_task(task_id, sandbox_id, planner, model_client, suppress_errors=True) as on_event, \
+                    aclosing(planner.run_task(lang="zh")) as events:
+                async for event in events:
+                    if planner.cancelled or planner.needs_human:
                         break
-                    # Also extract planner message for finished state
-                    if msg_data.get('stage') == 'Planner':
-                        final_output = msg_data.get('message', '')
-                except:
-                    pass
-            # task_cancelled, final_output, _ = await _execute_planner_with_context_saving(
-            #     planner, model_client, task_id, sandbox_id
-            # )
-        except asyncio.CancelledError:
-            pass
-        except Exception as e:
-            error = e
-            if not planner.cancelled:
-                logger.error(f"Error executing task {task_id}: {e}")
-        finally:
-            # Unregister NOTIFY listener if using PostgreSQL
-            if hasattr(task_storage, 'unregister_cancel_listener'):
-                task_storage.unregister_cancel_listener(task_id)
-            
-            await _finalize_task(task_id, model_client, task_cancelled, planner, final_output, error, needs_human_intervention)
+                    on_event()
     
     except Exception as e:
         logger.error(f"Error in execute_task_background(): {e}")
@@ -397,54 +334,53 @@ async def list_tasks(status: Optional[str] = None, limit: Optional[int] = None,
         # Get tasks from storage
         tasks = await task_storage.list_tasks(status, limit, offset)
         
-        task_list = []
-        for task in tasks:
-            task_info = {
-                'task_id': task.task_id,
-                'status': task.status,
-                'query': task.query,
-                'created_at': task.created_at.isoformat() if task.created_at else None,
-                'updated_at': task.updated_at.isoformat() if task.updated_at else None
-            }
-            
-            # Add finished_output for completed tasks
-            if task.status == 'finished' and task.finished_output:
-                task_info['finished_output'] = task.finished_output
-            
-            task_list.append(task_info)
-        
-        return JSONResponse({
+        # Encoded with orjson when available; task lists can be large
+        return Response(json_dumps_bytes({
             'success': True,
-            'tasks': task_list,
-            'count': len(task_list)
-        })
+            'tasks': [_task_list_entry(task) for task in tasks],
+            'count': len(tasks)
+        }), media_type='application/json')
     
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
+def _task_list_entry(task: TaskData) -> dict:
+    task_info = {
+        'task_id': task.task_id,
+        'status': task.status,
+        'query': task.query,
+        'created_at': task.created_at.isoformat() if task.created_at else None,
+        'updated_at': task.updated_at.isoformat() if task.updated_at else None
+    }
+    
+    # Add finished_output for completed tasks
+    if task.status == 'finished' and task.finished_output:
+        task_info['finished_output'] = task.finished_output
+    return task_info
+
+
 @app.get('/api/agent/info')
 async def get_agent_info():
     """Get agent server info"""
     return JSONResponse({
         'version': 'mini-lybic-guiagent-0.1',
         'maxConcurrentTasks': 'unlimited',
-        'log_level': os.environ.get("LOG_LEVEL","DEBUG")
+        'log_level': _LOG_LEVEL
     })
 
 @app.get('/api/agent/tasks')
 async def list_active_tasks():
     """List all active tasks"""
     try:
-        async with active_tasks_lock:
-            tasks = [
-                {
-                    'task_id': task_id,
-                    'sandbox_id': planner.sandbox_id,
-                    'cancelled': planner.cancelled
-                }
-                for task_id, planner in active_tasks.items()
-            ]
+        tasks = [
+            {
+                'task_id': task_id,
+                'sandbox_id': planner.sandbox_id,
+                'cancelled': planner.cancelled
+            }
+            for task_id, planner in list(active_tasks.items())
+        ]
         return JSONResponse({'success': True, 'tasks': tasks, 'count': len(tasks)})
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -454,16 +390,16 @@ async def cancel_agent(req: CancelRequest):
     """Cancel agent task execution (stateless)"""
     try:
         if req.task_id:
+            # Signal the planner first if it runs on this instance, so it stops without
+            # waiting for the storage write below
+            planner = active_tasks.get(req.task_id)
+            if planner:
+                planner.cancelled = True
+                logger.info(f"Task {req.task_id} cancelled in local instance")
+
             # Request cancellation via storage (works across all instances)
             success = await task_storage.request_cancel_task(req.task_id)
             if success:
-                # Also try to cancel in-memory if running on this instance
-                async with active_tasks_lock:
-                    planner = active_tasks.get(req.task_id)
-                    if planner:
-                        planner.cancelled = True
-                        logger.info(f"Task {req.task_id} cancelled in local instance")
-                
                 # Check if task was already cancelled
                 task_data = await task_storage.get_task(req.task_id)
                 if task_data and task_data.status == 'cancelled':
@@ -489,14 +425,12 @@ async def cancel_agent(req: CancelRequest):
                 else:
                     raise HTTPException(status_code=404, detail='Task not found')
         else:
-            # Cancel all active tasks
+            # Cancel in-memory tasks on this instance first, then all active tasks via storage
+            for planner in list(active_tasks.values()):
+                planner.cancelled = True
+
             cancelled_count = await task_storage.request_cancel_all_tasks()
-            
-            # Also cancel in-memory tasks on this instance
-            async with active_tasks_lock:
-                for planner in active_tasks.values():
-                    planner.cancelled = True
-            
+
             return JSONResponse({'success': True, 'message': f'Cancellation requested for {cancelled_count} task(s)'})
     
     except HTTPException:
@@ -504,7 +438,7 @@ async def cancel_agent(req: CancelRequest):
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-def _setup_model_and_planner(task_id: str, sandbox_id: str, instruction: str,
+async def _setup_model_and_planner(task_id: str, sandbox_id: str, instruction: str,
                              continue_context: bool, existing_context: Optional[dict] = None,
                              user_system_prompt: Optional[str] = None, lybic_client: LybicClient|None = None,
                              llm_api_key: Optional[str] = None
@@ -513,10 +447,8 @@ def _setup_model_and_planner(task_id: str, sandbox_id: str, instruction: str,
     if not lybic_client:
         lybic_client = LybicClient()
 
-    ai_client = AsyncOpenAI(
-        api_key=llm_api_key,#os.environ.get('ARK_API_KEY'),
-        base_url=os.environ.get('ARK_API_ENDPOINT','https://ark.cn-beijing.volces.com/api/v3')
-    )
+    # A new client per call over a shared httpx transport pool, so requests reuse upstream connections
+    ai_client = get_async_openai(llm_api_key, ARK_API_ENDPOINT)
     
     model_client = AsyncChatModelClient(
         ai_client=ai_client,
@@ -528,9 +460,10 @@ def _setup_model_and_planner(task_id: str, sandbox_id: str, instruction: str,
     # Restore context or setup fresh prompt
     if continue_context and existing_context:
         model_client.restore_context_from_persistence(existing_context)
-        model_client.messages.append(UserMessage(role="user", content=instruction))
+        # Append after the restored history so the cached prefix stays byte-stable
+        model_client.add_user_message(instruction)
     else:
-        model_client.setup_prompt(DOUBAO_UI_TARS_SYSTEM_PROMPT_ZH, user_system_prompt, instruction)
+        await model_client.setup_prompt(DOUBAO_UI_TARS_SYSTEM_PROMPT_ZH, user_system_prompt, instruction)
     
     planner = Planner(
         sandbox_id=sandbox_id,
@@ -543,48 +476,81 @@ def _setup_model_and_planner(task_id: str, sandbox_id: str, instruction: str,
     return model_client, planner
 
 
-def _get_finished_message(msg):
-    # Extract finished output from message
-    if 'finished(' in msg:
-        match = re.search(r"finished\(content='([^']*)'\)", msg)
-        if match:
-            return match.group(1)
-    return None
-
-
-async def _execute_planner_with_context_saving(planner: Planner, model_client: AsyncChatModelClient,
-                                                task_id: str, sandbox_id: str):
-    """Execute planner and save context periodically - shared logic
+@asynccontextmanager
+async def _context_saving(planner: Planner, model_client: AsyncChatModelClient,
+                          task_id: str, sandbox_id: str):
+    """Save context periodically while the planner runs - shared logic
+    
+    Context saves are handed to a background writer so the event stream never
+    waits on storage. The caller iterates `planner.run_task` itself, so events
+    pass through a single generator frame.
     
-    Returns: yielded_messages
+    Returns: callback to invoke after each event
     """
     step_count = 0
+    context_queue: asyncio.Queue = asyncio.Queue()
+    writer_task = asyncio.create_task(_context_writer(context_queue, model_client, task_id, sandbox_id))
+
+    def on_event():
+        nonlocal step_count
+        step_count += 1
+        # Save context periodically (every 5 steps); a pending save already
+        # snapshots the latest context, so newer requests are coalesced into it
+        if step_count % 5 == 0 and not planner.cancelled and context_queue.empty():
+            context_queue.put_nowait(step_count)
+
     try:
-        async for msg in planner.run_task(lang="zh"):
-            yield msg
-            if planner.cancelled:
-                break
-            
-            # messages.append(msg)
-            step_count += 1
-            
-            # Save context periodically (every 5 steps)
-            if step_count % 5 == 0 and not planner.cancelled:
-                try:
-                    context = model_client.get_context_for_persistence()
-                    await task_storage.save_llm_context(task_id, context)
-                    await task_storage.update_task(task_id, {
-                        'sandbox_info': {'sandbox_id': sandbox_id}
-                    })
-                except Exception as e:
-                    logger.error(f"Failed to save context during execution: {e}")
+        yield on_event
+    finally:
+        context_queue.put_nowait(None)
+        await writer_task
 
+@asynccontextmanager
+async def _running_task(task_id: str, sandbox_id: str, planner: Planner, model_client: AsyncChatModelClient,
+                        suppress_errors: bool = False):
+    """Track a planner run and finalize the task when it ends - shared logic
+    
+    Registers the planner in `active_tasks`, saves context periodically and writes
+    the final status once the block exits, however it exits.
+    
+    Returns: callback to invoke after each event
+    """
+    active_tasks[task_id] = planner
+    task_cancelled = False
+    error = None
+    try:
+        # The context writer is flushed before the task is finalized
+        async with _context_saving(planner, model_client, task_id, sandbox_id) as on_event:
+            yield on_event
     except asyncio.CancelledError:
+        task_cancelled = True
         logger.info(f"Task {task_id} was cancelled")
         raise
     except Exception as e:
-        logger.error(f"Error during planner execution for task {task_id}: {e}")
-        raise
+        error = e
+        if not planner.cancelled:
+            logger.error(f"Error executing task {task_id}: {e}")
+        if not suppress_errors:
+            raise
+    finally:
+        await _finalize_task(task_id, model_client, task_cancelled, planner, planner.final_message, error,
+                             planner.needs_human)
+
+async def _context_writer(queue: asyncio.Queue, model_client: AsyncChatModelClient,
+                          task_id: str, sandbox_id: str):
+    """Save context snapshots requested through the queue until a None sentinel arrives"""
+    # The sandbox does not change during a run, so it is only written with the first snapshot
+    updates = {'sandbox_info': {'sandbox_id': sandbox_id}}
+    while True:
+        step_count = await queue.get()
+        if step_count is None:
+            return
+        try:
+            context = model_client.get_context_for_persistence()
+            if await task_storage.save_llm_context(task_id, context, updates):
+                updates = None
+        except Exception as e:
+            logger.error(f"Failed to save context during execution: {e}")
 
 async def _finalize_task(task_id: str, model_client: AsyncChatModelClient, 
                         task_cancelled: bool, planner: Planner, 
@@ -592,35 +558,36 @@ async def _finalize_task(task_id: str, model_client: AsyncChatModelClient,
                         needs_human_intervention: bool = False):
     """Finalize task - save context and update status - shared logic"""
     try:
-        context = model_client.get_context_for_persistence()
-        await task_storage.save_llm_context(task_id, context)
-        
         if task_cancelled or planner.cancelled:
-            await task_storage.update_task(task_id, {'status': 'cancelled'})
+            updates = {'status': 'cancelled'}
         elif needs_human_intervention:
             updates = {'status': 'human_intervention'}
             if final_output:
                 updates['finished_output'] = final_output
-            await task_storage.update_task(task_id, updates)
         elif error:
-            await task_storage.update_task(task_id, {
+            updates = {
                 'status': 'error',
                 'final_state': str(error)
-            })
+            }
         else:
             updates = {'status': 'finished'}
             if final_output:
                 updates['finished_output'] = final_output
-            await task_storage.update_task(task_id, updates)
+        
+        # Context and final status are written in a single update
+        context = model_client.get_context_for_persistence()
+        await task_storage.save_llm_context(task_id, context, updates)
     except Exception as e:
         logger.error(f"Failed to finalize task: {e}")
     finally:
-        async with active_tasks_lock:
-            active_tasks.pop(task_id, None)
+        active_tasks.pop(task_id, None)
 
 def main():
     import uvicorn
-    uvicorn.run(app, host='0.0.0.0', port=5000,log_level=os.environ.get("LOG_LEVEL", "DEBUG").lower())
+    # 'auto' selects uvloop and httptools when the `speedups` extra is installed,
+    # falling back to asyncio and h11 otherwise
+    uvicorn.run(app, host='0.0.0.0', port=5000, loop='auto', http='auto',
+                timeout_keep_alive=75, log_level=_LOG_LEVEL.lower())
 
 if __name__ == '__main__':
     main()
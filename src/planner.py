@@ -1,16 +1,62 @@
 import asyncio
-import json
+import functools
+import hashlib
+import random
+import re
 import uuid
-from typing import Tuple, AsyncGenerator, Any, Optional
+from collections import OrderedDict
+from datetime import datetime, timezone
+from typing import Tuple, AsyncGenerator, Any, Optional, Awaitable
 
 from lybic import ComputerUse, Sandbox, LybicClient
 from lybic.dto import ModelType, ExecuteSandboxActionDto
 
 from src.chat import AsyncChatModelClient
+from src.serialization import json_dumps_bytes
 from src.store import get_opensearch_store
 
 
+_FINISHED_PREFIX = "finished(content='"
+
+# Control actions handled by the planner itself, matched at the start of the action only so
+# that a keyword inside another action's arguments (e.g. typed text) is not mistaken for one
+_CONTROL_ACTION_RE = re.compile(r'(finished|call_user|output|save_memory|failed)\(')
+
+# Returned by `Planner._until_cancelled` when cancellation won the race
+_CANCELLED = object()
+
+# Responses longer than this are parsed in a worker thread. Parsing costs roughly
+# 0.5-1.5us per KB while a thread hop costs ~50us, so only huge outputs benefit.
+_PARSE_IN_THREAD_THRESHOLD = 256 * 1024
+
+# Actions are executed without asking the sandbox for a screenshot or cursor position
+_execute_action_dto = functools.partial(ExecuteSandboxActionDto, includeScreenShot=False, includeCursorPosition=False)
+
+# LRU of recently saved memories keyed by a hash of session and text; repeats skip the embedding and index write
+_SAVED_MEMORIES: "OrderedDict[bytes, None]" = OrderedDict()
+_SAVED_MEMORIES_SIZE = 1024
+
+_SSE_PREFIX = b"data: "
+_SSE_SUFFIX = b"\n\n"
+
+
+def _get_finished_message(msg: str) -> Optional[str]:
+    # Extract finished output from an action, i.e. the `xxx` in finished(content='xxx')
+    start = msg.find(_FINISHED_PREFIX)
+    if start < 0:
+        return None
+    start += len(_FINISHED_PREFIX)
+    end = msg.find("')", start)
+    if end < 0:
+        return None
+    content = msg[start:end]
+    # Same grammar as the former finished\(content='([^']*)'\) pattern
+    return None if "'" in content else content
+
+
 def parse_summary_and_action_from_model_response_v2(text: str) -> Tuple[Optional[str], Optional[str]]:
+    # A single pass of C-level split/strip/startswith; measured several times faster than
+    # a MULTILINE `Thought|Action` regex, which is retried at every character of the response
     lines = text.strip().split('\n')
 
     thought_lines = []
@@ -29,13 +75,115 @@ def parse_summary_and_action_from_model_response_v2(text: str) -> Tuple[Optional
         elif stripped_line.startswith('Action:'):
             current_section = 'action'
             action = stripped_line[len('Action:'):].strip()
-        else:
-            if current_section == 'thought' and stripped_line:
-                thought_lines.append(stripped_line)
+        elif current_section == 'thought':
+            thought_lines.append(stripped_line)
 
     thought = '\n'.join(thought_lines)
     return thought, action
 
+
+_END = object()
+
+
+async def buffered(agen: AsyncGenerator, size: int = 8) -> AsyncGenerator:
+    """
+    Iterate an async generator in a background task, keeping up to `size` items ready
+
+    The producer (screenshots, model calls, actions) runs ahead instead of waiting for a
+    slow consumer such as an HTTP stream. When the consumer stops, the producer is
+    cancelled and has fully unwound before this generator returns.
+
+    Args:
+        agen: Async generator to consume
+        size: Maximum number of buffered items
+
+    Returns:
+        AsyncGenerator: The items of `agen`, in order
+    """
+    queue: asyncio.Queue = asyncio.Queue(maxsize=size)
+    error: Optional[Exception] = None
+
+    async def produce():
+        nonlocal error
+        try:
+            async for item in agen:
+                await queue.put(item)
+        except Exception as e:
+            error = e
+        finally:
+            await agen.aclose()
+        await queue.put(_END)
+
+    producer = asyncio.create_task(produce())
+    try:
+        while (item := await queue.get()) is not _END:
+            yield item
+        if error:
+            raise error
+    finally:
+        producer.cancel()
+        # Keep draining while the producer unwinds so it cannot block on a full queue
+        while not producer.done():
+            getter = asyncio.ensure_future(queue.get())
+            await asyncio.wait((producer, getter), return_when=asyncio.FIRST_COMPLETED)
+            getter.cancel()
+
+
+def _memory_key(session_id: Optional[str], text: str) -> bytes:
+    """Key of a session's memory in the LRU of saved memories"""
+    return hashlib.sha256(f"{session_id}\x00{text}".encode()).digest()
+
+
+def _is_saved_memory(key: bytes) -> bool:
+    """
+    Check the LRU of saved memories
+
+    Returns:
+        bool: True if the same text was recently saved for the session
+    """
+    if key in _SAVED_MEMORIES:
+        _SAVED_MEMORIES.move_to_end(key)
+        return True
+    return False
+
+
+def _record_saved_memory(key: bytes):
+    """Record a memory in the LRU of saved memories once it is stored"""
+    _SAVED_MEMORIES[key] = None
+    if len(_SAVED_MEMORIES) > _SAVED_MEMORIES_SIZE:
+        _SAVED_MEMORIES.popitem(last=False)
+
+
+def format_sse(event: dict) -> bytes:
+    """
+    Format an event dictionary to an SSE frame
+
+    The frame is encoded UTF-8 bytes, which StreamingResponse sends without re-encoding.
+
+    Args:
+        event: Event data yielded by `Planner.run_task`
+
+    Returns:
+        bytes: Formatted SSE frame
+    """
+    return b"".join((_SSE_PREFIX, json_dumps_bytes(event), _SSE_SUFFIX))
+
+
+def is_final_event(event: dict) -> bool:
+    """
+    Check whether an event ends the stream because the task was cancelled or needs a human
+
+    Decided from the event itself rather than the planner's flags: when the planner runs ahead
+    through `buffered`, the flags are already set while earlier events are still queued.
+
+    Args:
+        event: Event data yielded by `Planner.run_task`
+
+    Returns:
+        bool: True if no further events should be sent
+    """
+    return bool(event.get('cancelled') or event.get('needs_human'))
+
 class Planner(object):
     def __init__(self, sandbox_id: str, model_client: AsyncChatModelClient, lybic: LybicClient, task_storage=None):
         self.lybic_computer_use = ComputerUse(lybic)
@@ -44,9 +192,50 @@ class Planner(object):
         self.sandbox_id: str = sandbox_id
         self.lybic_sandbox = Sandbox(lybic)
         self.model_client: AsyncChatModelClient = model_client
-        self.cancelled = False
+        self.cancel_event = asyncio.Event()
         self.task_storage = task_storage
+        self._mem_store = get_opensearch_store()
         self._cancel_check_interval = 3  # Check cancellation every N actions
+        # Outcome of the run, read by the caller once the event stream ends
+        self.needs_human = False
+        self.final_message: Optional[str] = None
+
+    @property
+    def cancelled(self) -> bool:
+        return self.cancel_event.is_set()
+
+    @cancelled.setter
+    def cancelled(self, value: bool):
+        if value:
+            self.cancel_event.set()
+        else:
+            self.cancel_event.clear()
+
+    async def _until_cancelled(self, aw: Awaitable) -> Any:
+        """
+        Await `aw`, abandoning it as soon as cancellation is requested
+
+        Args:
+            aw: Awaitable to run
+
+        Returns:
+            The awaitable's result, or `_CANCELLED` if the task was cancelled first
+        """
+        if self.cancel_event.is_set():
+            if asyncio.iscoroutine(aw):
+                aw.close()
+            return _CANCELLED
+        task = asyncio.ensure_future(aw)
+        cancel_wait = asyncio.ensure_future(self.cancel_event.wait())
+        try:
+            await asyncio.wait((task, cancel_wait), return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            cancel_wait.cancel()
+            if not task.done():
+                task.cancel()
+        if not task.done() or task.cancelled():
+            return _CANCELLED
+        return task.result()
 
     async def _take_screenshot(self) -> Tuple[int, int, str]:
         """
@@ -58,41 +247,45 @@ class Planner(object):
         for i in range(3):
             try:
                 result = await self.lybic_sandbox.preview(self.sandbox_id)
+                if result is None:
+                    raise ValueError("empty preview response")
                 # image_base64 = await self.lybic_sandbox.get_screenshot_base64(self.sandbox_id)
                 print("Screenshot captured - size=", result.cursorPosition)
                 return result.cursorPosition.screenWidth, result.cursorPosition.screenHeight, result.screenShot
             except Exception as e:
                 print(f"Attempt {i + 1} to take screenshot failed: {e}")
                 if i < 2:
-                    await asyncio.sleep(1)  # wait for 1 second before retrying
+                    # exponential backoff with jitter: ~50ms, then ~100ms; transient failures recover fast
+                    await asyncio.sleep(0.05 * (2 ** i) + random.uniform(0, 0.02))
                 else:
                     raise
         return -1, -1, ""
 
-    def _format_sse(self, data: dict | None = None, **kwargs) -> str:
+    def _event(self, payload: dict) -> dict:
         """
-        Format data to SSE compliant string
+        Build a task event, serialized with `format_sse` at the HTTP boundary
 
         Args:
-            data: Initial data dictionary
-            **kwargs: Additional fields to merge
+            payload: Event data, completed in place
 
         Returns:
-            str: Formatted SSE string
+            dict: Event data with task id and timestamp
         """
-        if not data:
-            data = {}
-        data.update(kwargs)
-        data['taskId'] = self.task_id
-        data['timestamp'] = data.get('timestamp') or __import__('datetime').datetime.now().isoformat()
-        return f"data: {json.dumps(data, ensure_ascii=False)}\n\n"
-
-    async def _check_cancellation(self) -> bool:
+        payload['taskId'] = self.task_id
+        if 'timestamp' not in payload:
+            # UTC with an explicit offset, so ordering survives DST changes; formatted as ISO 8601 by the serializer
+            payload['timestamp'] = datetime.now(timezone.utc)
+        return payload
+
+    async def _check_cancellation(self, poll_storage: bool = True) -> bool:
         """
         Check if task cancellation has been requested.
         
         This checks both the in-memory flag and queries storage (for stateless cancellation).
         
+        Args:
+            poll_storage: Also query storage; skipped to save a round trip when False
+        
         Returns:
             bool: True if cancellation was requested
         """
@@ -100,7 +293,7 @@ class Planner(object):
             return True
         
         # Check storage if available (polling fallback)
-        if self.task_storage and self.task_id:
+        if poll_storage and self.task_storage and self.task_id:
             try:
                 cancel_requested = await self.task_storage.check_cancel_requested(self.task_id)
                 if cancel_requested:
@@ -111,118 +304,122 @@ class Planner(object):
         
         return False
 
-    async def run_task(self, lang: str = "zh") -> AsyncGenerator[str, Any]:
+    async def run_task(self, lang: str = "zh") -> AsyncGenerator[dict, Any]:
         start_action = "开始" if lang == "zh" else "Start"
-        yield self._format_sse({"stage": "System", "message": start_action})
+        yield self._event({"stage": "System", "message": start_action})
         if self.model_client.memories:
             memories_text = "\n".join([f"- {m}" for m in self.model_client.memories])
-            yield self._format_sse({"stage": "System", "message": f"📝 Loaded memories:\n{memories_text}"})
+            yield self._event({"stage": "System", "message": f"📝 Loaded memories:\n{memories_text}"})
 
+        cancel_msg = "任务已取消" if lang == "zh" else "Task cancelled"
         try:
             for action_idx in range(self.max_actions):
-                # Check if task is cancelled (checks both memory and storage)
-                if await self._check_cancellation():
-                    cancel_msg = "任务已取消" if lang == "zh" else "Task cancelled"
-                    yield self._format_sse({"stage": "System", "message": f"🚫 {cancel_msg}", "cancelled": True})
+                if self.cancelled:
+                    yield self._event({"stage": "System", "message": f"🚫 {cancel_msg}", "cancelled": True})
                     break
 
-                # capture screenshot (no need to send to frontend as they don't display it)
-                screen_width, screen_height, screenshot_image = await self._take_screenshot()
+                # capture screenshot (no need to send to frontend as they don't display it), overlapped
+                # with the cancellation check. The in-memory flag is set instantly by the cancel endpoint
+                # and NOTIFY; storage is only polled every `_cancel_check_interval` actions
+                screenshot_task = asyncio.ensure_future(self._take_screenshot())
+                try:
+                    cancelled = await self._check_cancellation(
+                        poll_storage=action_idx % self._cancel_check_interval == 0)
+                except BaseException:
+                    screenshot_task.cancel()
+                    raise
+                if cancelled:
+                    screenshot_task.cancel()
+                    yield self._event({"stage": "System", "message": f"🚫 {cancel_msg}", "cancelled": True})
+                    break
+                screen_width, screen_height, screenshot_image = await screenshot_task
                 # image_base64 = f"data:image/webp;base64,{screenshot_image}"
 
-                # Check if task is cancelled periodically
-                if action_idx % self._cancel_check_interval == 0:
-                    if await self._check_cancellation():
-                        cancel_msg = "任务已取消" if lang == "zh" else "Task cancelled"
-                        yield self._format_sse({"stage": "System", "message": f"🚫 {cancel_msg}", "cancelled": True})
-                        break
-
-                # get next action
-                response = await self.model_client.process_screenshot_and_update_history_messages(screenshot_image)
-                summary, action = parse_summary_and_action_from_model_response_v2(
-                    response)  # self.model_action_adaptor.parse_summary_and_action_from_model_response(response)
+                # get next action; the model call is abandoned as soon as cancellation is requested
+                response = await self._until_cancelled(
+                    self.model_client.process_screenshot_and_update_history_messages(screenshot_image))
+                if response is _CANCELLED:
+                    yield self._event({"stage": "System", "message": f"🚫 {cancel_msg}", "cancelled": True})
+                    break
+                if len(response) > _PARSE_IN_THREAD_THRESHOLD:
+                    summary, action = await asyncio.to_thread(parse_summary_and_action_from_model_response_v2, response)
+                else:
+                    summary, action = parse_summary_and_action_from_model_response_v2(
+                        response)  # self.model_action_adaptor.parse_summary_and_action_from_model_response(response)
 
                 if not action:
                     print("No action returned, skipping")
                     continue
-                if "finished(" in action:
-                    yield self._format_sse({"stage": "Grounding", "message": f"✅ {summary}\n\nAction: {action}"})
-                    yield self._format_sse({"stage": "System", "message": "Task completed successfully!", "done": True})
+                match = _CONTROL_ACTION_RE.match(action)
+                kind = match[1] if match else None
+                if kind == "finished":
+                    self.final_message = _get_finished_message(action)
+                    yield self._event({"stage": "Grounding", "message": f"✅ {summary}\n\nAction: {action}"})
+                    yield self._event({"stage": "System", "message": "Task completed successfully!", "done": True})
                     break
-                if "call_user(" in action:
-                    yield self._format_sse({"stage": "System", "message": f"👤 Calling user for help\n\n{summary}", "needs_human": True})
+                if kind == "call_user":
+                    message = f"👤 Calling user for help\n\n{summary}"
+                    self.needs_human = True
+                    self.final_message = message
+                    yield self._event({"stage": "System", "message": message, "needs_human": True})
                     break
-                if "output(" in action:
+                if kind == "output":
                     self.model_client.add_output_messages()
-                    yield self._format_sse({"stage": "System", "message": f"💾 Output saved: {summary}"})
+                    yield self._event({"stage": "System", "message": f"💾 Output saved: {summary}"})
                     continue
-                if "save_memory(" in action:
-                    store = get_opensearch_store()
-                    if store:
-                        # Use session-specific namespace for memory isolation
-                        store.put((self.model_client.session_id,), key=str(uuid.uuid4()), value={"text": summary},
-                                  index=["text"])
-                    yield self._format_sse({"stage": "System", "message": f"🧠 Memory saved: {summary}"})
+                if kind == "save_memory":
+                    memory_key = _memory_key(self.model_client.session_id, summary)
+                    if self._mem_store and not _is_saved_memory(memory_key):
+                        # Use session-specific namespace for memory isolation; embedding and
+                        # indexing are blocking HTTP calls, so they run in a worker thread
+                        await asyncio.to_thread(self._mem_store.put, (self.model_client.session_id,),
+                                                key=str(uuid.uuid4()), value={"text": summary}, index=["text"])
+                        # Only a stored memory is skipped later; a failed put can be retried
+                        _record_saved_memory(memory_key)
+                    yield self._event({"stage": "System", "message": f"🧠 Memory saved: {summary}"})
                     continue
-                if "failed(" in action:
-                    yield self._format_sse(
+                if kind == "failed":
+                    yield self._event(
                         {"stage": "Error", "message": f"❌ Task failed: {summary}\n\nAction: {action}"})
                     break
 
-                # Check if task is cancelled
-                if await self._check_cancellation():
-                    cancel_msg = "任务已取消" if lang == "zh" else "Task cancelled"
-                    yield self._format_sse({"stage": "System", "message": f"🚫 {cancel_msg}", "cancelled": True})
-                    break
-
                 # Parse and execute action
                 parse_result = await self.lybic_computer_use.parse_llm_output(
                     model_type=ModelType.UITARS,
                     llm_output=response
                 )
 
-                # Check if task is cancelled
+                # Check if task is cancelled before touching the sandbox
                 if self.cancelled:
-                    cancel_msg = "任务已取消" if lang == "zh" else "Task cancelled"
-                    yield self._format_sse({"stage": "System", "message": f"🚫 {cancel_msg}", "cancelled": True})
+                    yield self._event({"stage": "System", "message": f"🚫 {cancel_msg}", "cancelled": True})
                     break
 
                 # Send thinking/summary as a separate message
                 if summary:
-                    yield self._format_sse({"stage": "manager_planner", "message": f"💭 Thought: {summary}"})
-
-                # Execute action(s)
-                if len(parse_result.actions) == 1:
-                    yield self._format_sse({"stage": "Grounding", "message": f"🎯 Executing action: {action}"})
-                    await self.lybic_sandbox.execute_sandbox_action(
-                        self.sandbox_id,
-                        ExecuteSandboxActionDto(
-                            action=parse_result.actions[0],
-                            includeScreenShot=False,
-                            includeCursorPosition=False
-                        )
-                    )
+                    yield self._event({"stage": "manager_planner", "message": f"💭 Thought: {summary}"})
+
+                # Execute action(s), announced in one frame; GUI actions depend on each other, so they run in order
+                actions = parse_result.actions
+                if len(actions) == 1:
+                    message = f"🎯 Executing action: {action}"
                 else:
-                    for idx, parsed_action in enumerate(parse_result.actions, 1):
-                        yield self._format_sse({"stage": "Grounding",
-                                                "message": f"🎯 Executing action {idx}/{len(parse_result.actions)}: {parsed_action}"})
-                        await self.lybic_sandbox.execute_sandbox_action(
-                            self.sandbox_id,
-                            ExecuteSandboxActionDto(
-                                action=parsed_action,
-                                includeScreenShot=False,
-                                includeCursorPosition=False
-                            )
-                        )
-                # sleep several seconds
-                await asyncio.sleep(1.5)
+                    actions_text = "\n".join(f"{idx}. {parsed_action}" for idx, parsed_action in enumerate(actions, 1))
+                    message = f"🎯 Executing {len(actions)} actions:\n{actions_text}"
+                yield self._event({"stage": "Grounding", "message": message})
+                for parsed_action in actions:
+                    await self.lybic_sandbox.execute_sandbox_action(self.sandbox_id, _execute_action_dto(action=parsed_action))
+                # sleep several seconds, waking early if cancellation is requested
+                try:
+                    await asyncio.wait_for(self.cancel_event.wait(), timeout=1.5)
+                except asyncio.TimeoutError:
+                    pass
         except Exception as e:
             print("Task execution failed, error=%s", e)
             error_msg = "任务执行遇到问题，请稍后重试" if lang == "zh" else "Task execution encountered a problem, please try again later."
-            yield self._format_sse({"stage": "Error", "message": f"❌ {error_msg}", "error": str(e)})
+            yield self._event({"stage": "Error", "message": f"❌ {error_msg}", "error": str(e)})
         except asyncio.CancelledError as e:
             print("Task execution failed, error=%s", e)
             error_msg = "请求MCP服务超时，请稍后重试" if lang == "zh" else "Request to MCP server timed out, please try again later."
-            yield self._format_sse({"stage": "Error", "message": f"❌ {error_msg}", "error": str(e)})
+            yield self._event({"stage": "Error", "message": f"❌ {error_msg}", "error": str(e)})
         finally:
             print("Task completed, task_id=%s", self.task_id)
@@ -0,0 +1,72 @@
+"""
+JSON serialization helpers.
+
+Uses `orjson` when it is installed and falls back to the standard library `json` module.
+"""
+import json
+import logging
+from datetime import date
+from typing import Any
+
+logger = logging.getLogger(__name__)
+
+# Import orjson conditionally
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    ORJSON_AVAILABLE = False
+    orjson = None
+    logger.debug("`orjson` not installed. Falling back to the standard json module.")
+
+
+def _default(obj: Any) -> Any:
+    # Mirrors orjson, which serializes dates and datetimes natively as ISO 8601
+    if isinstance(obj, date):
+        return obj.isoformat()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+def json_dumps_bytes(obj: Any) -> bytes:
+    """
+    Serialize an object to compact UTF-8 encoded JSON.
+
+    Args:
+        obj: Object to serialize
+
+    Returns:
+        bytes: JSON document
+    """
+    if ORJSON_AVAILABLE:
+        return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(obj, ensure_ascii=False, separators=(',', ':'), default=_default).encode('utf-8')
+
+
+def json_dumps(obj: Any) -> str:
+    """
+    Serialize an object to a compact JSON string, keeping non-ASCII characters.
+
+    Args:
+        obj: Object to serialize
+
+    Returns:
+        str: JSON document
+    """
+    if ORJSON_AVAILABLE:
+        return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS).decode('utf-8')
+    return json.dumps(obj, ensure_ascii=False, separators=(',', ':'), default=_default)
+
+
+def json_loads(data: bytes | str) -> Any:
+    """
+    Deserialize a JSON document.
+
+    Args:
+        data: JSON document as bytes or str
+
+    Returns:
+        The deserialized object
+    """
+    if ORJSON_AVAILABLE:
+        return orjson.loads(data)
+    return json.loads(data)
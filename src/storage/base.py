@@ -1,18 +1,23 @@
 """
 Base storage interface for task persistence.
 """
+import asyncio
 from abc import ABC, abstractmethod
-from dataclasses import dataclass, asdict
+from dataclasses import dataclass
 from typing import Optional, Dict, Any, List
 from datetime import datetime
 
 
-@dataclass
+@dataclass(slots=True)
 class TaskData:
     """
     Data structure for task information.
     
     This class represents all the data that needs to be persisted for a task.
+    
+    Backends never encode a whole TaskData: PostgresStorage maps fields to columns and
+    MemoryStorage keeps the instances, so a faster struct/codec type would not pay off.
+    Slots keep the instances MemoryStorage holds small.
     """
     task_id: str
     status: str  # pending, running, finished, error, cancelled
@@ -31,28 +36,37 @@ class TaskData:
     cancelled_at: Optional[datetime] = None  # Timestamp when cancellation was requested
     
     def to_dict(self) -> Dict[str, Any]:
-        """Convert TaskData to dictionary for serialization."""
-        data = asdict(self)
+        """
+        Convert TaskData to dictionary for serialization.
+        
+        The copy is shallow: nested dicts and lists are shared with this instance.
+        """
+        data = {key: getattr(self, key) for key in self.__slots__}
         # Convert datetime objects to ISO format strings
-        if self.created_at:
-            data['created_at'] = self.created_at.isoformat()
-        if self.updated_at:
-            data['updated_at'] = self.updated_at.isoformat()
+        for key in _DATETIME_FIELDS:
+            value = data[key]
+            if value:
+                data[key] = value.isoformat()
         return data
     
     @classmethod
     def from_dict(cls, data: Dict[str, Any]) -> 'TaskData':
         """Create TaskData from dictionary."""
+        data = dict(data)
         # Convert ISO format strings back to datetime objects
-        if 'created_at' in data and data['created_at']:
-            if isinstance(data['created_at'], str):
-                data['created_at'] = datetime.fromisoformat(data['created_at'])
-        if 'updated_at' in data and data['updated_at']:
-            if isinstance(data['updated_at'], str):
-                data['updated_at'] = datetime.fromisoformat(data['updated_at'])
+        for key in _DATETIME_FIELDS:
+            value = data.get(key)
+            if value and isinstance(value, str):
+                data[key] = datetime.fromisoformat(value)
         return cls(**data)
 
 
+_DATETIME_FIELDS = ('created_at', 'updated_at', 'cancelled_at')
+
+# Upper bound on concurrent cancellation requests issued by `request_cancel_all_tasks`
+_CANCEL_ALL_CONCURRENCY = 32
+
+
 class TaskStorage(ABC):
     """
     Abstract base class for task storage implementations.
@@ -74,6 +88,24 @@ class TaskStorage(ABC):
         """
         pass
     
+    async def create_tasks(self, tasks: List[TaskData]) -> bool:
+        """
+        Create several task entries.
+        
+        The default implementation creates them one by one; backends that can insert
+        a batch in a single round trip override it.
+        
+        Args:
+            tasks: TaskData objects to create
+            
+        Returns:
+            bool: True if every task was created
+        """
+        created = True
+        for task_data in tasks:
+            created = await self.create_task(task_data) and created
+        return created
+    
     @abstractmethod
     async def get_task(self, task_id: str) -> Optional[TaskData]:
         """
@@ -118,7 +150,8 @@ class TaskStorage(ABC):
     async def list_tasks(self, 
                         status: Optional[str] = None,
                         limit: Optional[int] = None,
-                        offset: int = 0) -> List[TaskData]:
+                        offset: int = 0,
+                        include_payload: bool = False) -> List[TaskData]:
         """
         List tasks with optional filtering.
         
@@ -126,6 +159,8 @@ class TaskStorage(ABC):
             status: Filter by task status (optional)
             limit: Maximum number of tasks to return (optional)
             offset: Number of tasks to skip (for pagination)
+            include_payload: Also load the large JSONB fields (execution_statistics,
+                sandbox_info, request_data, llm_context); backends may leave them None otherwise
             
         Returns:
             List of TaskData objects
@@ -168,17 +203,21 @@ class TaskStorage(ABC):
         """
         return await self.update_task(task_id, {'finished_output': output})
     
-    async def save_llm_context(self, task_id: str, messages: List[Dict[str, Any]]) -> bool:
+    async def save_llm_context(self, task_id: str, messages: List[Dict[str, Any]],
+                               updates: Optional[Dict[str, Any]] = None) -> bool:
         """
         Save LLM conversation context for a task.
         
         Args:
             task_id: Unique identifier for the task
             messages: List of LLM message dictionaries (without image content)
+            updates: Other fields to write in the same update, saving a round trip
             
         Returns:
             bool: True if save was successful
         """
+        if updates:
+            return await self.update_task(task_id, {**updates, 'llm_context': messages})
         return await self.update_task(task_id, {'llm_context': messages})
     
     async def get_llm_context(self, task_id: str) -> Optional[List[Dict[str, Any]]]:
@@ -233,8 +272,12 @@ class TaskStorage(ABC):
             int: Number of tasks marked for cancellation
         """
         active_tasks = await self.list_tasks(status='running')
-        cancelled_count = 0
-        for task in active_tasks:
-            if await self.request_cancel_task(task.task_id):
-                cancelled_count += 1
-        return cancelled_count
+        semaphore = asyncio.Semaphore(_CANCEL_ALL_CONCURRENCY)
+
+        async def cancel(task_id: str) -> bool:
+            async with semaphore:
+                return await self.request_cancel_task(task_id)
+
+        # A failure for one task must not stop the others from being cancelled
+        results = await asyncio.gather(*(cancel(task.task_id) for task in active_tasks), return_exceptions=True)
+        return sum(1 for result in results if result is True)
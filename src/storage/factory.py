@@ -53,7 +53,11 @@ def create_storage(
             )
         
         logger.info("Using PostgreSQL task storage")
-        return PostgresStorage(postgres_connection_string)
+        return PostgresStorage(
+            postgres_connection_string,
+            pool_min_size=int(os.environ.get('POSTGRES_POOL_MIN_SIZE', 2)),
+            pool_max_size=int(os.environ.get('POSTGRES_POOL_MAX_SIZE', 10))
+        )
     
     else:
         raise ValueError(
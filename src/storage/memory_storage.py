@@ -84,6 +84,12 @@ class MemoryStorage(TaskStorage):
                 logger.warning(f"Task {task_id} not found for update")
                 return False
             
+            # Restarting a settled or paused task (e.g. continue_context) starts without the
+            # cancellation requested for its previous run, as in PostgresStorage
+            if (updates.get('status') in ('pending', 'running') and 'cancel_requested' not in updates
+                    and task_data.status in ('finished', 'error', 'cancelled', 'human_intervention')):
+                task_data.cancel_requested = False
+            
             # Update fields
             for key, value in updates.items():
                 if hasattr(task_data, key):
@@ -117,7 +123,8 @@ class MemoryStorage(TaskStorage):
     async def list_tasks(self, 
                         status: Optional[str] = None,
                         limit: Optional[int] = None,
-                        offset: int = 0) -> List[TaskData]:
+                        offset: int = 0,
+                        include_payload: bool = False) -> List[TaskData]:
         """
         List tasks with optional filtering from memory.
         
@@ -125,6 +132,7 @@ class MemoryStorage(TaskStorage):
             status: Filter by task status (optional)
             limit: Maximum number of tasks to return (optional)
             offset: Number of tasks to skip (for pagination)
+            include_payload: Ignored; in-memory tasks always carry every field
             
         Returns:
             List of TaskData objects
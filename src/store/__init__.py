@@ -1,6 +1,6 @@
 import os
 import threading
-from opensearchpy import OpenSearch, Urllib3HttpConnection
+from opensearchpy import OpenSearch, SSLError, Urllib3HttpConnection
 import socket
 from urllib3.connection import HTTPConnection
 
@@ -13,15 +13,15 @@ HTTPConnection.default_socket_options = [
     (socket.IPPROTO_TCP, socket.TCP_KEEPCNT, 5)
 ]
 
-_os_https_client, _os_http_client = None, None
+_os_client = None
 _opensearch_lock = threading.Lock()
 
 
 def get_opensearch_client():
-    global _os_https_client, _os_http_client, _opensearch_lock
+    global _os_client, _opensearch_lock
 
-    if _os_https_client is not None:
-        return _os_https_client, _os_http_client
+    if _os_client is not None:
+        return _os_client
 
     opensearch_config = {
         "host": "",
@@ -32,11 +32,14 @@ def get_opensearch_client():
         "text_embedding_dims":"",
     }
     if opensearch_config["host"] == "":
-        return _os_https_client, _os_http_client
+        return _os_client
 
     with _opensearch_lock:
-        if _os_https_client is None:
-            _os_https_client = OpenSearch(
+        if _os_client is None:
+            # Only https is used unless the server does not speak TLS: requests carry Basic
+            # auth credentials, which must not go over plaintext http while https works.
+            # The scheme is probed once here instead of on every store call.
+            client = OpenSearch(
                 hosts=[
                     {
                         "host": opensearch_config["host"],
@@ -49,21 +52,29 @@ def get_opensearch_client():
                 verify_certs=False,
                 ssl_assert_hostname=False,
                 ssl_show_warn=False,
+                retry_on_timeout=True,
+                max_retries=2,
                 connection_class=Urllib3HttpConnection
             )
-            _os_http_client = OpenSearch(
-                hosts=[
-                    {
-                        "host": opensearch_config["host"],
-                        "port": opensearch_config["port"],
-                    }
-                ],
-                scheme="http",
-                http_auth=(opensearch_config["username"], opensearch_config["password"]),
-                connection_class=Urllib3HttpConnection
-            )
-
-    return _os_https_client, _os_http_client
+            try:
+                client.info()
+            except SSLError:
+                client = OpenSearch(
+                    hosts=[
+                        {
+                            "host": opensearch_config["host"],
+                            "port": opensearch_config["port"],
+                        }
+                    ],
+                    scheme="http",
+                    http_auth=(opensearch_config["username"], opensearch_config["password"]),
+                    retry_on_timeout=True,
+                    max_retries=2,
+                    connection_class=Urllib3HttpConnection
+                )
+            _os_client = client
+
+    return _os_client
 
 
 _opensearch_store = None
@@ -75,8 +86,8 @@ def get_opensearch_store():
     if _opensearch_store is not None:
         return _opensearch_store
 
-    os_https_client, os_http_client = get_opensearch_client()
-    if os_https_client is None:
+    os_client = get_opensearch_client()
+    if os_client is None:
         return _opensearch_store
 
     with _opensearch_store_lock:
@@ -86,6 +97,9 @@ def get_opensearch_store():
 
             embeddings = DoubaoVisionEmbeddings("doubao-embedding-text-240715", os.environ.get('ARK_API_KEY'))
             index_config = IndexConfig(embed=embeddings, dims=2048)
-            _opensearch_store = OpenSearchStore(os_https_client, os_http_client, index=index_config,
-                                                threshold=0.6)
+            # The store is built once per process, so it sets up its templates at that point
+            _opensearch_store = OpenSearchStore(
+                os_client, index=index_config, threshold=0.6,
+                ensure_templates=os.environ.get("OPENSEARCH_ENSURE_TEMPLATES", "true").lower() == "true"
+            )
     return _opensearch_store
@@ -1,29 +1,99 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
 from dateutil import parser
 from typing import Iterable, cast, Optional, Sequence
 
 from langchain_core.embeddings import Embeddings
 from langgraph.store.base import BaseStore, Op, Result, GetOp, PutOp, SearchOp, IndexConfig, ensure_embeddings, \
     tokenize_path, get_text_at_path, ListNamespacesOp, SearchItem, Item
-from opensearchpy import OpenSearch, SSLError
-from opensearchpy.exceptions import NotFoundError
+from opensearchpy import AsyncOpenSearch, OpenSearch, helpers
+from opensearchpy.exceptions import NotFoundError, TransportError
 
 from .base import _group_ops, _namespace_to_text
 
+# k-NN engine of newly created vector index templates. An existing template keeps its
+# engine; to migrate, delete the template and reindex the vector indices.
+_KNN_ENGINE = "lucene"
+# HNSW graph parameters for the vector index: links per node, and candidate list size
+# used while building the graph
+_HNSW_M = 16
+_HNSW_EF_CONSTRUCTION = 200
+# Encoder of quantized vector indices: FAISS scalar quantization to fp16 halves the vector
+# storage and needs no training step, unlike product quantization
+_QUANTIZED_ENCODER = {"name": "sq", "parameters": {"type": "fp16"}}
+
+# Ingest pipeline stamping created_at/updated_at, and the component template applying it
+_TIMESTAMPS_PIPELINE = "ingest_with_timestamps"
+_TIMESTAMPS_COMPONENT = "timestamps_settings"
+
+# Limits of each bulk request sent by _batch_put_ops
+_BULK_CHUNK_SIZE = 500
+_BULK_MAX_CHUNK_BYTES = 100 * 1024 * 1024
+# Namespaces whose index names are cached; the cache is cleared when it grows past this
+_INDEX_NAMES_CACHE_SIZE = 4096
+
+
+def _parse_ts(value: str) -> datetime:
+    """
+    Parse an ISO 8601 timestamp set by the ingest pipeline.
+
+    Uses the much faster `datetime.fromisoformat` and falls back to dateutil for the
+    forms it rejects before Python 3.11 (e.g. fractions that are not 3 or 6 digits).
+    """
+    try:
+        return datetime.fromisoformat(value.replace("Z", "+00:00"))
+    except ValueError:
+        return parser.isoparse(value)
+
+
+def _nmslib_score(score: float) -> float:
+    """
+    Map a Lucene/FAISS cosine score, (1 + cos) / 2, to nmslib's 1 / (2 - cos).
+
+    Keeps `threshold` meaning the same similarity whichever engine built the index.
+    """
+    return 1 / (3 - 2 * score)
+
+
+def _vectors_to_lists(vectors) -> list[list[float]]:
+    """
+    Convert embeddings to plain lists for the JSON request body.
+
+    A 2D numpy array is converted with a single `tolist()` call, which is much cheaper
+    than converting it row by row.
+    """
+    if hasattr(vectors, "tolist"):
+        return vectors.tolist()
+    return [vector.tolist() if hasattr(vector, "tolist") else vector for vector in vectors]
+
 
 class OpenSearchStore(BaseStore):
     def __init__(
             self,
-            https_client: OpenSearch,
-            http_client: OpenSearch,
+            client: OpenSearch,
             *,
             index: Optional[IndexConfig] = None,
             store_prefix: str = "store",
-            threshold: float = 0.8
+            threshold: float = 0.8,
+            quantize: bool = False,
+            async_client: Optional[AsyncOpenSearch] = None,
+            ensure_templates: bool = False
     ) -> None:
+        """
+        Args:
+            ensure_templates: Create missing index templates now, see `ensure_templates`
+            async_client: Client used by `abatch`, which otherwise runs `batch` in a thread
+            quantize: Store vectors in FAISS indices quantized to fp16 instead of float32
+                Lucene indices. They live under separate index names, and `threshold` may
+                need re-tuning for them.
+        """
         BaseStore.__init__(self)
-        self.https_client = https_client
-        self.http_client = http_client
-        self.index_config = index
+        self.client = client
+        self.async_client = async_client
+        self._tokenized_paths: dict[str, list[str]] = {}  # path -> tokenized path of PutOp.index
+        self._index_names: dict[tuple[str, ...], tuple[str, Optional[str]]] = {}  # see _index_names_of
         self.threshold = threshold
 
         self.index_config = index
@@ -41,96 +111,214 @@ class OpenSearchStore(BaseStore):
             self.embeddings = None
 
         self.data_index = f"{store_prefix}_data"
+        self._quantize = quantize
+        # k-NN engine of the vector indices, read from their template; resolved by
+        # ensure_templates or by the first search
+        self.vector_engine: Optional[str] = None
+        if self.index_config:
+            dims = self.index_config["dims"]
+            # Quantized indices get their own name, so their pattern does not overlap the plain one
+            self.vector_index = (
+                f"{store_prefix}_vector_sq_{dims}" if quantize else f"{store_prefix}_vector_{dims}"
+            )
+
+        if ensure_templates:
+            self.ensure_templates()
+
+    @property
+    def _default_vector_engine(self) -> str:
+        """k-NN engine of vector index templates created by this store."""
+        return "faiss" if self._quantize else _KNN_ENGINE
+
+    @staticmethod
+    def _template_engine(response: dict) -> str:
+        """Read the k-NN engine from a get_index_template response."""
+        template = response["index_templates"][0]
+        embedding = template["index_template"]["template"]["mappings"]["properties"]["embedding"]
+        return embedding["method"].get("engine", "nmslib")
+
+    def _resolve_vector_engine(self, client: OpenSearch):
+        try:
+            self.vector_engine = self._template_engine(client.indices.get_index_template(name=self.vector_index))
+        except NotFoundError:
+            # No template yet; hits are scored as for the engine the template would get
+            pass
+
+    async def _aresolve_vector_engine(self):
+        try:
+            self.vector_engine = self._template_engine(
+                await self.async_client.indices.get_index_template(name=self.vector_index)
+            )
+        except NotFoundError:
+            pass
+
+    def ensure_templates(self):
+        """
+        Create the ingest pipeline and the index templates of the store if they are missing.
+
+        Costs a few requests, so deployments call it once at startup rather than on every
+        store construction.
+        """
         client = self.get_client()
-        if not client.indices.exists_template(name=self.data_index):
-            # todo 不更新created_at
-            client.ingest.put_pipeline(
-                id="ingest_with_timestamps",
-                body={
-                    "processors": [
-                        {
-                            "set": {
-                                "if": "ctx?.created_at == null",
-                                "field": "created_at",
-                                "value": "{{_ingest.timestamp}}"
+        # Independent requests run concurrently to shorten the cold start
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            vector_setup = executor.submit(self._ensure_vector_template, client) if self.index_config else None
+
+            if not client.indices.exists_index_template(name=self.data_index):
+                # todo 不更新created_at
+                pipeline_setup = executor.submit(
+                    client.ingest.put_pipeline,
+                    id=_TIMESTAMPS_PIPELINE,
+                    body={
+                        "processors": [
+                            {
+                                "set": {
+                                    "if": "ctx?.created_at == null",
+                                    "field": "created_at",
+                                    "value": "{{_ingest.timestamp}}"
+                                }
+                            },
+                            {
+                                "set": {
+                                    "field": "updated_at",
+                                    "value": "{{_ingest.timestamp}}"
+                                }
                             }
+                        ]
+                    }
+                )
+                # The timestamp settings and mappings live in a component template that any
+                # index template can compose
+                client.cluster.put_component_template(name=_TIMESTAMPS_COMPONENT, body={
+                    "template": {
+                        "settings": {
+                            "default_pipeline": _TIMESTAMPS_PIPELINE
                         },
-                        {
-                            "set": {
-                                "field": "updated_at",
-                                "value": "{{_ingest.timestamp}}"
+                        "mappings": {
+                            "properties": {
+                                "created_at": {
+                                    "type": "date",
+                                },
+                                "updated_at": {
+                                    "type": "date"
+                                },
                             }
                         }
-                    ]
+                    }
+                })
+                pipeline_setup.result()
+                body = {
+                    "index_patterns": [f"{self.data_index}_*"],
+                    "composed_of": [_TIMESTAMPS_COMPONENT],
+                    "template": {
+                        "mappings": {
+                            "properties": {
+                                "data": {
+                                    "type": "object"
+                                }
+                            }
+                        }
+                    }
                 }
+                client.indices.put_index_template(name=self.data_index, body=body)
+
+            if vector_setup:
+                vector_setup.result()
+
+    def _ensure_vector_template(self, client: OpenSearch):
+        dims = self.index_config["dims"]
+        if client.indices.exists_index_template(name=self.vector_index):
+            self.vector_engine = self._template_engine(
+                client.indices.get_index_template(name=self.vector_index)
             )
+        else:
+            self.vector_engine = self._default_vector_engine
+            parameters = {"m": _HNSW_M, "ef_construction": _HNSW_EF_CONSTRUCTION}
+            if self._quantize:
+                parameters["encoder"] = _QUANTIZED_ENCODER
             body = {
-                "index_patterns": [f"{self.data_index}_*"],
+                "index_patterns": [f"{self.vector_index}_*"],
                 "template": {
                     "settings": {
-                        "default_pipeline": "ingest_with_timestamps"
+                        "index": {
+                            "knn": True
+                        }
                     },
                     "mappings": {
                         "properties": {
-                            "data": {
-                                "type": "object"
-                            },
-                            "created_at": {
-                                "type": "date",
-                            },
-                            "updated_at": {
-                                "type": "date"
+                            "embedding": {
+                                "type": "knn_vector",
+                                "dimension": dims,
+                                "method": {
+                                    "name": "hnsw",
+                                    "engine": self.vector_engine,
+                                    "space_type": "cosinesimil",
+                                    "parameters": parameters
+                                }
                             },
+                            "key": {
+                                "type": "keyword"
+                            }
                         }
                     }
                 }
             }
-            client.indices.put_index_template(name=self.data_index, body=body)
+            client.indices.put_index_template(name=self.vector_index, body=body)
 
-        if self.index_config:
-            dims = self.index_config["dims"]
-            self.vector_index = f"{store_prefix}_vector_{dims}"
+    def get_client(self) -> OpenSearch:
+        return self.client
 
-            if not client.indices.exists_template(name=self.vector_index):
-                body = {
-                    "index_patterns": [f"{self.vector_index}_*"],
-                    "template": {
-                        "settings": {
-                            "index": {
-                                "knn": True,
-                                "knn.space_type": "cosinesimil",
-                            }
-                        },
-                        "mappings": {
-                            "properties": {
-                                "embedding": {
-                                    "type": "knn_vector",
-                                    "dimension": dims,
-                                    "method": {
-                                        "name": "hnsw",
-                                        "engine": "nmslib",
-                                        "space_type": "cosinesimil"
-                                    }
-                                },
-                                "key": {
-                                    "type": "keyword"
-                                }
-                            }
-                        }
-                    }
-                }
-                client.indices.put_index_template(name=self.vector_index, body=body)
+    def _index_names_of(self, namespace: tuple[str, ...]) -> tuple[str, Optional[str]]:
+        """Return the data index name and, with an index config, the vector index name of a namespace."""
+        names = self._index_names.get(namespace)
+        if names is None:
+            if len(self._index_names) >= _INDEX_NAMES_CACHE_SIZE:
+                self._index_names.clear()
+            ns = _namespace_to_text(namespace)
+            names = self._index_names[namespace] = (
+                f"{self.data_index}_{ns}",
+                f"{self.vector_index}_{ns}" if self.index_config else None,
+            )
+        return names
 
-    def get_client(self) -> OpenSearch:
-        client = self.https_client
-        try:
-            client.info()
-        except SSLError:
-            client = self.http_client
-        return client
+    def _tokenize_path(self, path: str) -> list[str]:
+        """Tokenize a path, parsing each distinct path only once."""
+        tokens = self._tokenized_paths.get(path)
+        if tokens is None:
+            tokens = self._tokenized_paths[path] = tokenize_path(path)
+        return tokens
 
     async def abatch(self, ops: Iterable[Op]) -> list[Result]:
-        pass
+        if self.async_client is None:
+            return await asyncio.to_thread(self.batch, ops)
+
+        grouped_ops, num_ops = _group_ops(ops)
+        results: list[Result] = [None] * num_ops
+
+        # Same order as `batch`: gets see the documents before the puts, searches after them
+        if GetOp in grouped_ops:
+            await self._abatch_get_ops(
+                cast(list[tuple[int, GetOp]], grouped_ops[GetOp]), results
+            )
+
+        if PutOp in grouped_ops:
+            await self._abatch_put_ops(cast(list[tuple[int, PutOp]], grouped_ops[PutOp]))
+
+        if SearchOp in grouped_ops:
+            await self._abatch_search_ops(
+                cast(list[tuple[int, SearchOp]], grouped_ops[SearchOp]), results
+            )
+
+        if ListNamespacesOp in grouped_ops:
+            self._batch_list_namespaces_ops(
+                cast(
+                    Sequence[tuple[int, ListNamespacesOp]],
+                    grouped_ops[ListNamespacesOp],
+                ),
+                results,
+            )
+
+        return results
 
     def batch(self, ops: Iterable[Op]) -> list[Result]:
         grouped_ops, num_ops = _group_ops(ops)
@@ -160,45 +348,59 @@ class OpenSearchStore(BaseStore):
 
         return results
 
-    def _batch_get_ops(self, get_ops: list[tuple[int, GetOp]], results: list[Result]):
-        client = self.get_client()
+    # Request building and response handling below are shared by the sync and async paths
+
+    def _get_buckets(self, get_ops: list[tuple[int, GetOp]]) -> dict[str, list[tuple[int, GetOp]]]:
+        """Group get ops by data index, so each index is fetched in one request."""
+        buckets: dict[str, list[tuple[int, GetOp]]] = {}
         for idx, get_op in get_ops:
-            ns = _namespace_to_text(get_op.namespace)
-            index_name = f"{self.data_index}_{ns}"
-            doc = client.get(index=index_name, id=get_op.key)
+            index_name, _ = self._index_names_of(get_op.namespace)
+            buckets.setdefault(index_name, []).append((idx, get_op))
+        return buckets
+
+    @staticmethod
+    def _set_get_results(bucket: list[tuple[int, GetOp]], docs: list[dict], results: list[Result]):
+        for (idx, get_op), doc in zip(bucket, docs):
+            if not doc.get("found"):
+                continue
             results[idx] = Item(namespace=get_op.namespace, key=get_op.key, value=doc["_source"]["data"],
-                                created_at=parser.isoparse(doc["_source"]["created_at"]),
-                                updated_at=parser.isoparse(doc["_source"]["updated_at"]))
+                                created_at=_parse_ts(doc["_source"]["created_at"]),
+                                updated_at=_parse_ts(doc["_source"]["updated_at"]))
 
-    def _batch_put_ops(self, put_ops: list[tuple[int, PutOp]]):
-        client = self.get_client()
+    def _put_actions(
+            self, put_ops: list[tuple[int, PutOp]]
+    ) -> tuple[list[dict], list[tuple[str, str, str, str]], dict[str, list[str]]]:
+        """
+        Build the bulk actions of the data documents of put ops.
+
+        Returns:
+            The data writes and deletes, the (key, path, vector index, text) of every text to
+            embed, and the keys whose vectors are deleted by vector index
+        """
+        actions: list[dict] = []
+        to_embed: list[tuple[str, str, str, str]] = []
+        deleted_keys: dict[str, list[str]] = {}
         for idx, put_op in put_ops:
-            ns = _namespace_to_text(put_op.namespace)
-            data_index_name = f"{self.data_index}_{ns}"
-            vector_index_name = f"{self.vector_index}_{ns}"
+            data_index_name, vector_index_name = self._index_names_of(put_op.namespace)
 
             if put_op.value is None:
-                client.delete(index=data_index_name, id=put_op.key)
+                actions.append({"_op_type": "delete", "_index": data_index_name, "_id": put_op.key})
 
                 if self.index_config:
-                    client.delete_by_query(index=vector_index_name, body={
-                        "query": {
-                            "term": {
-                                "key": put_op.key
-                            }
-                        }
-                    })
+                    deleted_keys.setdefault(vector_index_name, []).append(put_op.key)
 
                 continue
 
-            client.index(index=data_index_name, id=put_op.key, body={"data": put_op.value})
+            actions.append({
+                "_op_type": "index", "_index": data_index_name, "_id": put_op.key,
+                "_source": {"data": put_op.value}
+            })
 
             if self.index_config and put_op.index is not False:
-                to_embed: list[tuple[str, str]] = []
                 paths = (
                     self.index_config["__tokenized_fields"]
                     if put_op.index is None
-                    else [(ix, tokenize_path(ix)) for ix in put_op.index]
+                    else [(ix, self._tokenize_path(ix)) for ix in put_op.index]
                 )
                 for path, field in paths:
                     texts = get_text_at_path(put_op.value, field)
@@ -207,40 +409,51 @@ class OpenSearchStore(BaseStore):
                     if len(texts) > 1:
                         for i, text in enumerate(texts):
                             to_embed.append(
-                                (f"{path}.{i}", text)
+                                (put_op.key, f"{path}.{i}", vector_index_name, text)
                             )
                     else:
-                        to_embed.append((path, texts[0]))
-
-                if not to_embed:
-                    continue
+                        to_embed.append((put_op.key, path, vector_index_name, texts[0]))
+        return actions, to_embed, deleted_keys
 
-                vectors = self.embeddings.embed_documents(
-                    [text for _, text in to_embed]
-                )
-
-                for (path, _), vector in zip(to_embed, vectors):
-                    client.index(index=vector_index_name, id=f"{put_op.key}_{path}", body={
-                        "key": put_op.key,
-                        "field_name": path,
-                        "embedding": (
-                            vector.tolist() if hasattr(vector, "tolist") else vector
-                        )
-                    })
+    @staticmethod
+    def _delete_vectors_body(keys: list[str]) -> dict:
+        return {
+            "query": {
+                "terms": {
+                    "key": keys
+                }
+            }
+        }
 
-    def _batch_search_ops(self, search_ops: list[tuple[int, SearchOp]], results: list[Result]):
-        if not self.index_config or not self.embeddings or not search_ops:
-            return
+    @staticmethod
+    def _vector_actions(to_embed: list[tuple[str, str, str, str]], vectors) -> list[dict]:
+        return [
+            {
+                "_op_type": "index", "_index": vector_index_name, "_id": f"{key}_{path}",
+                "_source": {
+                    "key": key,
+                    "field_name": path,
+                    "embedding": vector
+                }
+            }
+            for (key, path, vector_index_name, _), vector in zip(to_embed, _vectors_to_lists(vectors))
+        ]
 
-        client = self.get_client()
-        for idx, search_op in search_ops:
-            ns = _namespace_to_text(search_op.namespace_prefix)
-            data_index_name = f"{self.data_index}_{ns}"
-            vector_index_name = f"{self.vector_index}_{ns}"
+    @staticmethod
+    def _raise_bulk_errors(errors: list[dict]):
+        # Deleting a document that does not exist is not an error
+        errors = [error for error in errors if error.get("delete", {}).get("status") != 404]
+        if errors:
+            raise helpers.BulkIndexError(f"{len(errors)} document(s) failed to index.", errors)
 
-            vector = self.embeddings.embed_query(search_op.query)
+    def _search_body(self, search_ops: list[tuple[int, SearchOp]], vectors) -> list[dict]:
+        """Build the msearch body running the kNN search of every search op."""
+        body = []
+        for (_, search_op), vector in zip(search_ops, _vectors_to_lists(vectors)):
+            _, vector_index_name = self._index_names_of(search_op.namespace_prefix)
             limit = search_op.limit if search_op.limit is not None else 3
-            body = {
+            body.append({"index": vector_index_name})
+            body.append({
                 "size": limit,
                 "query": {
                     "knn": {
@@ -251,28 +464,145 @@ class OpenSearchStore(BaseStore):
                     }
                 },
                 "_source": ["key"]
-            }
-            try:
-                vector_results = client.search(index=vector_index_name, body=body)
-            except NotFoundError:
+            })
+        return body
+
+    def _search_hits(self, vector_results: dict) -> list[tuple[str, float]]:
+        """Return the (key, score) of the hits of one msearch response above the threshold."""
+        error = vector_results.get("error")
+        if error:
+            # A namespace without any indexed vector has no index yet
+            if error.get("type") == "index_not_found_exception":
+                return []
+            raise TransportError(vector_results.get("status", 500), error.get("type"), error)
+
+        hits = []
+        for hit in vector_results["hits"]["hits"]:
+            score = hit["_score"] if self.vector_engine == "nmslib" else _nmslib_score(hit["_score"])
+            if score >= self.threshold:
+                hits.append((hit["_source"]["key"], score))
+        return hits
+
+    @staticmethod
+    def _search_items(search_op: SearchOp, hits: list[tuple[str, float]], docs: list[dict]) -> list[SearchItem]:
+        items = []
+        for (key, score), doc in zip(hits, docs):
+            if not doc.get("found"):
                 continue
+            items.append(SearchItem(
+                namespace=search_op.namespace_prefix,
+                key=key,
+                value=doc["_source"]["data"],
+                created_at=_parse_ts(doc["_source"]["created_at"]),
+                updated_at=_parse_ts(doc["_source"]["updated_at"]),
+                score=score,
+            ))
+        return items
+
+    def _batch_get_ops(self, get_ops: list[tuple[int, GetOp]], results: list[Result]):
+        client = self.get_client()
+        for index_name, bucket in self._get_buckets(get_ops).items():
+            docs = client.mget(index=index_name, body={"ids": [get_op.key for _, get_op in bucket]})["docs"]
+            self._set_get_results(bucket, docs, results)
+
+    def _batch_put_ops(self, put_ops: list[tuple[int, PutOp]]):
+        client = self.get_client()
+        # Data writes, deletes and vector writes of the whole batch, sent as one bulk request
+        actions, to_embed, deleted_keys = self._put_actions(put_ops)
+
+        # One delete_by_query per namespace, before the new vectors are written
+        for vector_index_name, keys in deleted_keys.items():
+            client.delete_by_query(index=vector_index_name, body=self._delete_vectors_body(keys),
+                                   conflicts="proceed", ignore_unavailable=True)
 
+        if to_embed:
+            # One embedding call for the whole batch instead of one per op
+            vectors = self.embeddings.embed_documents([text for _, _, _, text in to_embed])
+            actions.extend(self._vector_actions(to_embed, vectors))
+
+        if not actions:
+            return
+
+        _, errors = helpers.bulk(client, actions, chunk_size=_BULK_CHUNK_SIZE,
+                                 max_chunk_bytes=_BULK_MAX_CHUNK_BYTES, raise_on_error=False)
+        self._raise_bulk_errors(errors)
+
+    def _batch_search_ops(self, search_ops: list[tuple[int, SearchOp]], results: list[Result]):
+        if not self.index_config or not self.embeddings or not search_ops:
+            return
+
+        client = self.get_client()
+        if self.vector_engine is None:
+            self._resolve_vector_engine(client)
+        # Embed all queries in one call and run all kNN searches in one msearch request
+        vectors = self.embeddings.embed_documents([search_op.query for _, search_op in search_ops])
+        responses = client.msearch(body=self._search_body(search_ops, vectors))["responses"]
+
+        for (idx, search_op), vector_results in zip(search_ops, responses):
+            hits = self._search_hits(vector_results)
             items = []
-            for hit in vector_results["hits"]["hits"]:
-                score = hit["_score"]
-                if score < self.threshold:
-                    continue
-                key = hit["_source"]["key"]
-                doc = client.get(index=data_index_name, id=key)
-                items.append(SearchItem(
-                    namespace=search_op.namespace_prefix,
-                    key=key,
-                    value=doc["_source"]["data"],
-                    created_at=parser.isoparse(doc["_source"]["created_at"]),
-                    updated_at=parser.isoparse(doc["_source"]["updated_at"]),
-                    score=score,
-                ))
+            if hits:
+                # Fetch the data documents of all hits in one request
+                data_index_name, _ = self._index_names_of(search_op.namespace_prefix)
+                docs = client.mget(index=data_index_name, body={"ids": [key for key, _ in hits]})["docs"]
+                items = self._search_items(search_op, hits, docs)
             results[idx] = items
 
+    async def _abatch_get_ops(self, get_ops: list[tuple[int, GetOp]], results: list[Result]):
+        buckets = list(self._get_buckets(get_ops).items())
+        responses = await asyncio.gather(*(
+            self.async_client.mget(index=index_name, body={"ids": [get_op.key for _, get_op in bucket]})
+            for index_name, bucket in buckets
+        ))
+        for (_, bucket), response in zip(buckets, responses):
+            self._set_get_results(bucket, response["docs"], results)
+
+    async def _abatch_put_ops(self, put_ops: list[tuple[int, PutOp]]):
+        actions, to_embed, deleted_keys = self._put_actions(put_ops)
+
+        deletes = [
+            self.async_client.delete_by_query(index=vector_index_name, body=self._delete_vectors_body(keys),
+                                              conflicts="proceed", ignore_unavailable=True)
+            for vector_index_name, keys in deleted_keys.items()
+        ]
+        if to_embed:
+            # Embed while the vectors of deleted keys are removed; both finish before the bulk
+            vectors, *_ = await asyncio.gather(
+                self.embeddings.aembed_documents([text for _, _, _, text in to_embed]), *deletes
+            )
+            actions.extend(self._vector_actions(to_embed, vectors))
+        else:
+            await asyncio.gather(*deletes)
+
+        if not actions:
+            return
+
+        _, errors = await helpers.async_bulk(self.async_client, actions, chunk_size=_BULK_CHUNK_SIZE,
+                                             max_chunk_bytes=_BULK_MAX_CHUNK_BYTES, raise_on_error=False)
+        self._raise_bulk_errors(errors)
+
+    async def _abatch_search_ops(self, search_ops: list[tuple[int, SearchOp]], results: list[Result]):
+        if not self.index_config or not self.embeddings or not search_ops:
+            return
+
+        if self.vector_engine is None:
+            await self._aresolve_vector_engine()
+        vectors = await self.embeddings.aembed_documents([search_op.query for _, search_op in search_ops])
+        responses = (await self.async_client.msearch(body=self._search_body(search_ops, vectors)))["responses"]
+
+        searches = [(idx, search_op, self._search_hits(vector_results))
+                    for (idx, search_op), vector_results in zip(search_ops, responses)]
+        # Fetch the data documents of the hits of every search concurrently
+        docs = await asyncio.gather(*(
+            self.async_client.mget(
+                index=self._index_names_of(search_op.namespace_prefix)[0],
+                body={"ids": [key for key, _ in hits]}
+            )
+            for _, search_op, hits in searches if hits
+        ))
+        docs = iter(docs)
+        for idx, search_op, hits in searches:
+            results[idx] = self._search_items(search_op, hits, next(docs)["docs"]) if hits else []
+
     def _batch_list_namespaces_ops(self, param, results):
         pass
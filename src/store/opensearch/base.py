@@ -1,17 +1,25 @@
-from collections import defaultdict
 from typing import Iterable
 
-from langgraph.store.base import Op
+from langgraph.store.base import Op, GetOp, PutOp, SearchOp, ListNamespacesOp
 
 
 def _group_ops(ops: Iterable[Op]) -> tuple[dict[type, list[tuple[int, Op]]], int]:
-    """Group operations by type for batch processing."""
-    grouped_ops: dict[type, list[tuple[int, Op]]] = defaultdict(list)
+    """Group operations by type for batch processing; only types with ops get a key."""
+    gets, puts, searches, list_namespaces = [], [], [], []
     tot = 0
     for idx, op in enumerate(ops):
-        grouped_ops[type(op)].append((idx, op))
+        op_type = type(op)
+        if op_type is PutOp:
+            puts.append((idx, op))
+        elif op_type is GetOp:
+            gets.append((idx, op))
+        elif op_type is SearchOp:
+            searches.append((idx, op))
+        elif op_type is ListNamespacesOp:
+            list_namespaces.append((idx, op))
         tot += 1
-    return grouped_ops, tot
+    grouped_ops = {GetOp: gets, PutOp: puts, SearchOp: searches, ListNamespacesOp: list_namespaces}
+    return {op_type: bucket for op_type, bucket in grouped_ops.items() if bucket}, tot
 
 
 def _namespace_to_text(
@@ -1,6 +1,34 @@
+import base64
+import logging
+from array import array
+
 from langchain_core.embeddings import Embeddings
 from openai import OpenAI, AsyncOpenAI, NotGiven, NOT_GIVEN
 
+logger = logging.getLogger(__name__)
+
+# Import numpy conditionally
+try:
+    import numpy as np
+    NUMPY_AVAILABLE = True
+except ImportError:
+    NUMPY_AVAILABLE = False
+    np = None
+    logger.debug("`numpy` not installed. Decoding embeddings with the array module.")
+
+
+def _decode_embeddings(data) -> list[list[float]]:
+    """
+    Decode base64 embeddings of little-endian float32 values.
+
+    Returns plain lists, as the `Embeddings` interface promises. With numpy, the batch is
+    decoded as one 2D array and converted with a single `tolist()` call.
+    """
+    raw = [base64.b64decode(r.embedding) for r in data]
+    if NUMPY_AVAILABLE:
+        return np.frombuffer(b"".join(raw), dtype="<f4").reshape(len(raw), -1).tolist()
+    return [array("f", r).tolist() for r in raw]
+
 
 class DoubaoTextEmbeddings(Embeddings):
     def __init__(self, model, api_key, base_url, dims: int | NotGiven = NOT_GIVEN):
@@ -27,12 +55,10 @@ class DoubaoTextEmbeddings(Embeddings):
         resp = self.client.embeddings.create(
             model=self.model,
             input=texts,
-            encoding_format="float",
+            encoding_format="base64",
             dimensions=self.dims
         )
-        if not isinstance(resp, dict):
-            resp = resp.model_dump()
-        return [r["embedding"] for r in resp["data"]]
+        return _decode_embeddings(resp.data)
 
     def embed_query(self, text: str) -> list[float]:
         return self.embed_documents([text])[0]
@@ -41,12 +67,10 @@ class DoubaoTextEmbeddings(Embeddings):
         resp = await self.async_client.embeddings.create(
             model=self.model,
             input=texts,
-            encoding_format="float",
+            encoding_format="base64",
             dimensions=self.dims
         )
-        if not isinstance(resp, dict):
-            resp = resp.model_dump()
-        return [r["embedding"] for r in resp["data"]]
+        return _decode_embeddings(resp.data)
 
     async def aembed_query(self, text: str) -> list[float]:
         embeddings = await self.aembed_documents([text])
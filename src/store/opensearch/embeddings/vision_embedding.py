@@ -1,9 +1,16 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
 from langchain_core.embeddings import Embeddings
 from volcenginesdkarkruntime import Ark, AsyncArk
 from volcenginesdkarkruntime.types.multimodal_embedding import MultimodalEmbeddingContentPartTextParam
 
 
 class DoubaoVisionEmbeddings(Embeddings):
+    # The multimodal endpoint embeds one input per request, so batches are fanned out
+    # with at most this many requests in flight
+    MAX_CONCURRENCY = 8
+
     def __init__(self, model, api_key, **kwargs):
         self.model = model
         self.client = Ark(api_key=api_key)
@@ -18,11 +25,12 @@ class DoubaoVisionEmbeddings(Embeddings):
         Returns:
             A list of embeddings, one for each text.
         """
-        # results = []
-        # for text in texts:
-        #     results.append(self.embed_query(text))
-        # return results
-        return [self.embed_query(text) for text in texts]
+        if len(texts) <= 1:
+            return [self.embed_query(text) for text in texts]
+        # Threads rather than asyncio.run: the async client is bound to the event loop it
+        # first ran on, and this may be called while a loop is already running
+        with ThreadPoolExecutor(max_workers=min(len(texts), self.MAX_CONCURRENCY)) as executor:
+            return list(executor.map(self.embed_query, texts))
 
     def embed_query(self, text: str) -> list[float]:
         resp = self.client.multimodal_embeddings.create(
@@ -34,7 +42,13 @@ class DoubaoVisionEmbeddings(Embeddings):
         return resp.data["embedding"]
 
     async def aembed_documents(self, texts: list[str]) -> list[list[float]]:
-        return [await self.aembed_query(text) for text in texts]
+        semaphore = asyncio.Semaphore(self.MAX_CONCURRENCY)
+
+        async def embed(text: str) -> list[float]:
+            async with semaphore:
+                return await self.aembed_query(text)
+
+        return list(await asyncio.gather(*(embed(text) for text in texts)))
 
     async def aembed_query(self, text: str) -> list[float]:
         resp = await self.async_client.multimodal_embeddings.create(
@@ -0,0 +1,66 @@
+import asyncio
+import json
+
+from src import planner as planner_module
+from src.planner import Planner, buffered, format_sse, is_final_event
+
+
+class _FakeModelClient:
+    """Model client that answers every screenshot with a fixed response"""
+
+    def __init__(self, response: str):
+        self.response = response
+        self.memories = []
+        self.session_id = 'session'
+
+    async def process_screenshot_and_update_history_messages(self, screenshot_image: str) -> str:
+        return self.response
+
+
+def _make_planner(monkeypatch, response: str) -> Planner:
+    monkeypatch.setattr(planner_module, 'ComputerUse', lambda lybic: None)
+    monkeypatch.setattr(planner_module, 'Sandbox', lambda lybic: None)
+    monkeypatch.setattr(planner_module, 'get_opensearch_store', lambda: None)
+    planner = Planner('sandbox', _FakeModelClient(response), lybic=None)
+    planner.task_id = 'task'
+
+    async def take_screenshot():
+        return 1280, 720, 'screenshot'
+
+    planner._take_screenshot = take_screenshot
+    return planner
+
+
+async def _stream_frames(planner: Planner) -> list:
+    """Collect SSE frames the way `run_agent` streams them, over a slow connection"""
+    frames = []
+    async for event in buffered(planner.run_task(lang="en")):
+        frames.append(format_sse(event))
+        # Let the planner run ahead, as it does while an HTTP write is in flight
+        await asyncio.sleep(0.01)
+        if is_final_event(event):
+            break
+    return frames
+
+
+def _decode(frame: bytes) -> dict:
+    return json.loads(frame[len(b"data: "):])
+
+
+def test_call_user_frame_is_delivered(monkeypatch):
+    planner = _make_planner(monkeypatch, "Thought: Need a password\nAction: call_user()")
+
+    frames = asyncio.run(_stream_frames(planner))
+
+    assert planner.needs_human
+    assert _decode(frames[0])['message'] == 'Start'
+    assert _decode(frames[-1])['needs_human'] is True
+
+
+def test_cancelled_frame_is_delivered(monkeypatch):
+    planner = _make_planner(monkeypatch, "Thought: Waiting\nAction: wait()")
+    planner.cancelled = True
+
+    frames = asyncio.run(_stream_frames(planner))
+
+    assert _decode(frames[-1])['cancelled'] is True